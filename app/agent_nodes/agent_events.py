@@ -0,0 +1,49 @@
+import asyncio
+import json
+from contextvars import ContextVar
+from typing import Optional
+
+# Per-request destination for agent stream events. The compiled graph is shared
+# by all requests, so nodes find their request's sink through this context var.
+_current_sink: ContextVar[Optional["EventSink"]] = ContextVar("agent_event_sink", default=None)
+
+
+class EventSink:
+    """Queue of stream events for one /agent_infer request.
+
+    ``emit`` is safe to call from sync nodes that LangGraph runs in worker threads.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(self, event: dict):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self.queue.put_nowait(event)
+        else:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+def bind_event_sink(sink: EventSink):
+    """Route events emitted from the current context (and tasks it spawns) to ``sink``."""
+    return _current_sink.set(sink)
+
+
+def emit_event(event: dict):
+    sink = _current_sink.get()
+    if sink is not None:
+        sink.emit(event)
+
+
+def format_sse(event: dict) -> str:
+    """Serialize an event as a Server-Sent Events frame named after its type."""
+    name = event.get("event") or event.get("status") or "message"
+    return f"event: {name}\ndata: {json.dumps(event)}\n\n"
@@ -2,10 +2,25 @@ from typing import Optional, TypedDict, List, Dict, Any
 
 class AgentState(TypedDict):
     query: str
+    query_embedding: Optional[List[float]]
     document_id: Optional[str]
     fund_name: Optional[str]
     top_k: Optional[int]
+    ef_search: Optional[int]
+    probes: Optional[int]
+    search_mode: Optional[str]
+    top_docs: Optional[int]
+    chunks_per_doc: Optional[int]
+    retrieval_mode: Optional[str]
+    vector_weight: Optional[float]
+    lexical_weight: Optional[float]
+    rrf_k: Optional[int]
+    segment_types: Optional[List[str]]
+    page_from: Optional[int]
+    page_to: Optional[int]
     sequence: List[str]
     step_results: Dict[str, Any]
+    retrieved_chunks: Optional[List[Dict[str, Any]]]
+    context: Optional[str]
     llm_synthesis: Optional[str]
     fund_types: Optional[List[str]]
\ No newline at end of file
@@ -1,33 +1,99 @@
-from ..db import get_connection
 from app.util.embedding_client import get_embedding
-from typing import TypedDict, Optional
 from ..agent_nodes.agent_state import AgentState
+from ..agent_nodes.agent_events import emit_event
+from ..vector_store import get_vector_store
+from ..util.context_packer import CONTEXT_DEDUPE_ENABLED
+from contextvars import ContextVar
+from typing import Optional
 import asyncio
+import logging
+import os
 
-async def doc_search(state: AgentState) -> dict:
+logger = logging.getLogger(__name__)
+
+# Corpus-wide search: "hierarchical" ranks documents by summary_embedding first
+# and only searches chunks of the top documents; "flat" scans all chunks.
+DOC_SEARCH_MODE = os.getenv("DOC_SEARCH_MODE", "hierarchical")
+DOC_SEARCH_TOP_DOCS = int(os.getenv("DOC_SEARCH_TOP_DOCS", "5"))
+DOC_SEARCH_CHUNKS_PER_DOC = int(os.getenv("DOC_SEARCH_CHUNKS_PER_DOC", "5"))
+# Retrieval: "vector" (ANN only) or "hybrid" (full-text + ANN, reciprocal rank fusion).
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+HYBRID_VECTOR_WEIGHT = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+# Start retrieval while entry_router is still deciding the route.
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+
+# Speculative search task of the current request (set before the graph runs).
+_speculative_search: ContextVar[Optional[asyncio.Task]] = ContextVar("speculative_search", default=None)
+
+def _weight(value, default: float) -> float:
+    return float(default if value is None else value)
+
+async def retrieve(state: AgentState) -> list:
+    """Embed the query if needed and run the vector store search described by ``state``."""
     document_id = state.get("document_id")
     query = state.get("query")
     top_k = state.get("top_k", 3)
+    ef_search = state.get("ef_search")
+    probes = state.get("probes")
+    search_mode = state.get("search_mode") or DOC_SEARCH_MODE
+    top_docs = state.get("top_docs") or DOC_SEARCH_TOP_DOCS
+    chunks_per_doc = state.get("chunks_per_doc") or DOC_SEARCH_CHUNKS_PER_DOC
+    retrieval_mode = state.get("retrieval_mode") or RETRIEVAL_MODE
 
     if isinstance(query, dict) and "query" in query:
         query_text = query["query"]
     else:
         query_text = query
-    query_Vector = await get_embedding(query_text)
-    def db_query():
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                if document_id:
-                    cur.execute("""
-                        SELECT chunk from embeddings where document_id = %s ORDER BY (vector_embedding <=> %s::vector) LIMIT %s
-                    """, (document_id, query_Vector, top_k))
-                else:
-                    cur.execute("""
-                        SELECT chunk from embeddings ORDER BY (1- vector_embedding <=> %s::vector) LIMIT %s
-                    """, (query_Vector, top_k))
-                results = [r[0] for r in cur.fetchall()]
-                return "\n".join(results)
-    context = await asyncio.to_thread(db_query)
+    query_Vector = state.get("query_embedding") or await get_embedding(query_text)
+    return await get_vector_store().search(
+        query_Vector, top_k, document_id=document_id, query_text=query_text,
+        ef_search=ef_search, probes=probes, search_mode=search_mode, top_docs=top_docs,
+        chunks_per_doc=chunks_per_doc, retrieval_mode=retrieval_mode,
+        hybrid_candidates=HYBRID_CANDIDATES,
+        vector_weight=_weight(state.get("vector_weight"), HYBRID_VECTOR_WEIGHT),
+        lexical_weight=_weight(state.get("lexical_weight"), HYBRID_LEXICAL_WEIGHT),
+        rrf_k=state.get("rrf_k") or HYBRID_RRF_K,
+        segment_types=state.get("segment_types"), page_from=state.get("page_from"), page_to=state.get("page_to"),
+        # Hit vectors are only used by near-duplicate dropping in pack_context.
+        with_vectors=CONTEXT_DEDUPE_ENABLED,
+    )
+
+
+def start_speculative_search(state: AgentState) -> asyncio.Task:
+    """Start ``retrieve`` for this request before routing has decided whether it is needed.
+
+    entry_router only chooses the node sequence, so the search inputs are already
+    final; doc_search picks the task up instead of searching again.
+    """
+    task = asyncio.create_task(retrieve(dict(state)))
+    _speculative_search.set(task)
+    return task
+
+
+def cancel_speculative_search():
+    """Drop the speculative search of this request, e.g. when the route skips doc_search."""
+    task = _speculative_search.get()
+    if task is not None and not task.done():
+        # Routing functions may run in a worker thread.
+        task.get_loop().call_soon_threadsafe(task.cancel)
+
+
+async def doc_search(state: AgentState) -> dict:
+    task = _speculative_search.get()
+    hits = None
+    if task is not None and not task.cancelled():
+        try:
+            hits = await task
+        except Exception as e:
+            logger.warning("Speculative search failed, searching again: %s", e)
+    emit_event({"event": "speculative_search", "node": "doc_search", "used": hits is not None})
+    if hits is None:
+        hits = await retrieve(state)
+    results = [hit["chunk"] for hit in hits]
+    context = "\n".join(results)
     step_results = state.get("step_results", {})
     step_results["doc_search"] = context
-    return {"context": context, "step_results": step_results}
\ No newline at end of file
+    return {"context": context, "retrieved_chunks": hits, "step_results": step_results}
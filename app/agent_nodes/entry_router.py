@@ -1,9 +1,11 @@
-from openai import OpenAI
+import logging
 from .agent_state import AgentState
 from app.util.openai_client import get_chat_content
 from app.util.llm_utils import extract_sequence_from_llm_response
 
-def entry_router(state: AgentState) -> dict:
+logger = logging.getLogger(__name__)
+
+async def entry_router(state: AgentState) -> dict:
     query = state.get("query", "")
 
     system_prompt = (
@@ -17,7 +19,7 @@ def entry_router(state: AgentState) -> dict:
     )
 
     try:
-        content = get_chat_content(
+        content = await get_chat_content(
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": query}
@@ -30,5 +32,5 @@ def entry_router(state: AgentState) -> dict:
         sequence = extract_sequence_from_llm_response(content)
         return {"sequence": sequence}
     except Exception as e:
-        print(f"Error in entry_router: {e}")
+        logger.warning("Error in entry_router: %s", e)
         return {"sequence": ["doc_search", "llm_synthesis"]}
\ No newline at end of file
@@ -1,10 +1,17 @@
+import logging
 from .agent_state import AgentState
-from app.util.openai_client import get_chat_content
+from .agent_events import emit_event
+from app.util.openai_client import stream_chat_content
+from app.util.context_packer import pack_context
 
-def llm_synthesis(state: AgentState) -> dict:
+logger = logging.getLogger(__name__)
+
+FALLBACK_ANSWER = "I'm sorry, I couldn't generate a response at this time."
+
+async def llm_synthesis(state: AgentState) -> dict:
     query = state.get("query", "")
-    step_results = state.get("step_results", {})
-    
+    context, context_stats = pack_context(state.get("retrieved_chunks") or [])
+    emit_event({"event": "context", "node": "llm_synthesis", **context_stats})
 
     system_prompt = (
         "You are a helpful assistant. Use the provided context to answer the user's question. "
@@ -14,14 +21,17 @@ def llm_synthesis(state: AgentState) -> dict:
     )
 
     try:
-        answer = get_chat_content(
+        parts = []
+        async for delta in stream_chat_content(
             messages=[{"role": "system", "content": system_prompt},
-                      {"role": "user", "content": f"User question: {query}\nContext: {step_results}"}],
+                      {"role": "user", "content": f"User question: {query}\n\nContext:\n{context}"}],
             model="sonar", max_retries=3, temperature=0.7, max_tokens=4096
-        )
+        ):
+            parts.append(delta)
+            emit_event({"event": "token", "node": "llm_synthesis", "delta": delta})
+        answer = "".join(parts)
     except Exception as e:
-        print(f"Error in llm_synthesis: {e}")
-        import traceback; traceback.print_exc()
-        answer = "I'm sorry, I couldn't generate a response at this time."
-    return {"llm_synthesis": answer}
+        logger.exception("Error in llm_synthesis: %s", e)
+        answer = FALLBACK_ANSWER
+    return {"llm_synthesis": answer, "context": context}
     
\ No newline at end of file
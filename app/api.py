@@ -1,89 +1,85 @@
+from typing import List, Literal, Optional
 from pydantic import BaseModel
-from fastapi import FastAPI
 from .langgraph_agent import  agent_infer_langgraph_stream
-from .util.embedding_client import get_embedding, get_embeddings, get_message
+from .util.embedding_client import embedding_cache
 from fastapi import Query
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import StreamingResponse
-from .utils import (
-    extract_text_from_docx, 
-    extract_text_from_pdf,
-    extract_rich_pdf_segments,    
-    chunk_text,
-    chunk_segments,
-)
-from .db import get_connection
-import tempfile, os, asyncio
-from app.util.chunk_summary import extractive_summary
+from fastapi import APIRouter, UploadFile, File, HTTPException, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from .db import get_connection, pool_stats
+from .ingest import SUPPORTED_EXTENSIONS, document_exists, find_document_by_hash
+from .jobs import spool_upload, enqueue_job, get_job, queue_depth
+import os
+from app.util import answer_cache
+from app.util.metrics import render_metrics
 
 router = APIRouter()
 
-@router.post("/upload")
+@router.post("/upload", status_code=202)
 async def upload_file(
+    response: Response,
     text_extract_only: bool = Query(False),
+    extract_workers: Optional[int] = Query(None, ge=1, le=32),
+    replaces: Optional[int] = Query(None, description="Id of the document this file is a new version of."),
     file: UploadFile = File(...)):
-    if not file.filename.lower().endswith(('.txt', '.docx', ".pdf")):
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
         raise HTTPException(status_code=400, detail="Invalid file type. Only .txt, .docx and .pdf are allowed.")
-    
+    if replaces is not None and not await document_exists(replaces):
+        raise HTTPException(status_code=404, detail="Document to replace not found.")
+
     suffix = os.path.splitext(file.filename)[1] or ".tmp"
-    tmp_path = None
-    tmp = None
-    try:
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-        tmp.write(await file.read())
-        tmp_path = tmp.name
-        tmp.close()  # Ensure file is closed before further use
+    spool_path, content_hash = await spool_upload(file, suffix)
+    existing_id = await find_document_by_hash(content_hash)
+    if existing_id is not None:
+        os.remove(spool_path)
+        # Nothing was queued: 200 with the existing document, not 202.
+        response.status_code = 200
+        return {"status": "duplicate", "message": f"{file.filename} is already ingested", "document_id": existing_id}
+    job = await enqueue_job(spool_path, file.filename, text_extract_only=text_extract_only,
+                            extract_workers=extract_workers, content_hash=content_hash, replaces=replaces)
+    return {"status": "queued", "message": f"Queued {file.filename} for ingestion", "job_id": job["id"]}
 
-        lowered = file.filename.lower()
-        if lowered.endswith('.txt'):
-            with open(tmp_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-        elif lowered.endswith('.docx'):
-            text = extract_text_from_docx(tmp_path)
-        elif lowered.endswith(".pdf"):
-            segments = extract_rich_pdf_segments(tmp_path, text_extract_only)
-            if segments:
-                chunks = chunk_segments(segments)
-            else:
-                text = extract_text_from_pdf(tmp_path)
-                chunks = chunk_text(text)
-        else:
-            chunks = []
-        if lowered.endswith(('.txt','.docx')):                            
-            chunks = chunk_text(text) 
-        vectors = await asyncio.gather(*[get_embedding(chunk) for chunk in chunks])
-        summary_text = extractive_summary(chunks, vectors, num_summary_chunks=5)
-        summary_embedding =await get_embedding(summary_text)
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("INSERT into documents (filename, summary_text, summary_embedding) VALUES (%s, %s, %s) RETURNING id", (file.filename, summary_text, summary_embedding ))
-                doc_id = cur.fetchone()[0]
-                
-                for idx, (chunk, vector) in enumerate(zip(chunks, vectors)):
-                    cur.execute("INSERT INTO embeddings (document_id, chunk, vector_embedding, chunk_index) VALUES (%s, %s, %s, %s)", (doc_id, chunk, vector, idx))
-            conn.commit()        
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.remove(tmp_path)
-            except PermissionError:
-                pass  # File is still in use, skip deletion
 
-    return {"status": "success", "message": f"Uploaded and processed {file.filename}", "document_id": doc_id, "num_chunks": len(chunks)}
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = await get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
 
 
 @router.post("/agent_infer")
-async def agent_infer(document_id: int, query: str, top_k: int = Query(3, ge=1, le=10)):
-    conn = get_connection()
-    return StreamingResponse(agent_infer_langgraph_stream(conn, document_id, query, top_k), media_type="application/json")
+async def agent_infer(query: str, document_id: Optional[int] = None, top_k: int = Query(3, ge=1, le=10),
+                      ef_search: Optional[int] = Query(None, ge=1, le=1000),
+                      probes: Optional[int] = Query(None, ge=1, le=10000),
+                      search_mode: Optional[Literal["flat", "hierarchical"]] = Query(None),
+                      top_docs: Optional[int] = Query(None, ge=1, le=100),
+                      chunks_per_doc: Optional[int] = Query(None, ge=1, le=50),
+                      retrieval_mode: Optional[Literal["vector", "hybrid"]] = Query(None),
+                      vector_weight: Optional[float] = Query(None, ge=0),
+                      lexical_weight: Optional[float] = Query(None, ge=0),
+                      rrf_k: Optional[int] = Query(None, ge=1, le=1000),
+                      segment_type: Optional[List[Literal["text", "table_row", "image"]]] = Query(None),
+                      page_from: Optional[int] = Query(None, ge=1),
+                      page_to: Optional[int] = Query(None, ge=1),
+                      use_cache: bool = Query(True),
+                      speculative: Optional[bool] = Query(None),
+                      timings: bool = Query(False)):
+    stream = agent_infer_langgraph_stream(document_id, query, top_k, use_cache=use_cache, speculative=speculative, timings=timings,
+                                          ef_search=ef_search, probes=probes, search_mode=search_mode,
+                                          top_docs=top_docs, chunks_per_doc=chunks_per_doc,
+                                          retrieval_mode=retrieval_mode, vector_weight=vector_weight,
+                                          lexical_weight=lexical_weight, rrf_k=rrf_k,
+                                          segment_types=segment_type, page_from=page_from, page_to=page_to)
+    return StreamingResponse(stream,
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @router.get("/documents")
 async def list_documents():
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT id, filename FROM documents ORDER BY id DESC")
-        docs = cur.fetchall()
-    conn.close()
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT id, filename FROM documents ORDER BY id DESC")
+            docs = await cur.fetchall()
     return [{"id": doc[0], "filename": doc[1]} for doc in docs]
 
 class ChatHistoryRequest(BaseModel):
@@ -94,25 +90,35 @@ class ChatHistoryRequest(BaseModel):
 
 @router.post("/chat_history")
 async def chat_history(request: ChatHistoryRequest):
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
                 INSERT INTO chat_history (code, message, timestamp, email_id) VALUES (%s, %s, %s, %s)
                 on conflict (code) do update set message = EXCLUDED.message, timestamp = EXCLUDED.timestamp, email_id = EXCLUDED.email_id
                 """,
             (request.code, request.message, request.timestamp, request.email_id)
         )
-        conn.commit()
     return {"status": "success", "message": "Chat history saved."}
 
 @router.get("/chat_history")
 async def get_chat_history(email_id: str = None, top_k: int = Query(10, ge=1, le=100)):
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT code, message, timestamp, email_id FROM chat_history WHERE email_id = %s ORDER BY timestamp DESC LIMIT %s", (email_id, top_k))
-            rows = cur.fetchall()
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT code, message, timestamp, email_id FROM chat_history WHERE email_id = %s ORDER BY timestamp DESC LIMIT %s", (email_id, top_k))
+            rows = await cur.fetchall()
             return [
                 {"code": row[0], "message": row[1], "timestamp": row[2], "email_id": row[3]}
                 for row in rows
-            ]
\ No newline at end of file
+            ]
+
+@router.get("/stats")
+async def get_stats():
+    return {"db_pool": pool_stats(), "embedding_cache": embedding_cache.stats(), "answer_cache": answer_cache.stats(),
+            "ingest_queue_depth": queue_depth()}
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Latency histograms and token counters in the Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
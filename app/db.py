@@ -1,37 +1,141 @@
 import os
-import psycopg2
-from psycopg2.extras import execute_values
+import time
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from typing import Callable, List, Optional
+from psycopg import AsyncCursor
+from psycopg_pool import AsyncConnectionPool
+from app.util.metrics import DB_QUERY_SECONDS
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DB_URL = os.getenv("DATABASE_URL")  
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+EMBEDDING_INSERT_BATCH_SIZE = int(os.getenv("EMBEDDING_INSERT_BATCH_SIZE", "500"))
 
-def get_connection():
-    return psycopg2.connect(DB_URL)
+# Vector column / ANN index settings. EMBEDDING_DIM must match EMBEDDING_MODEL.
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1536"))
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw").lower()  # "hnsw" or "ivfflat"
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+# pgvector >= 0.8: keep scanning the HNSW graph until filtered queries have enough rows.
+# "relaxed_order" / "strict_order", or "" to disable. Ignored on older pgvector.
+HNSW_ITERATIVE_SCAN = os.getenv("HNSW_ITERATIVE_SCAN", "relaxed_order")
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "100"))
 
-def create_tables():
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
+# Provenance columns of ``embeddings``, filled from the chunker's metadata.
+CHUNK_METADATA_COLUMNS = ("page_start", "page_end", "segment_type", "char_start", "char_end")
+
+# (table, column) pairs that get a cosine ANN index.
+VECTOR_COLUMNS = [
+    ("embeddings", "vector_embedding"),
+    ("documents", "summary_embedding"),
+]
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[AsyncConnectionPool] = None
+_iterative_scan_supported: Optional[bool] = None
+
+
+def _operation(query) -> str:
+    """Leading SQL keyword (SELECT, INSERT, ...) used as the metric label."""
+    words = query.split(None, 1) if isinstance(query, str) else []
+    return words[0].upper() if words else "OTHER"
+
+
+class TimedCursor(AsyncCursor):
+    """Cursor that records every ``execute`` and ``executemany`` in db_query_seconds and the request timings."""
+
+    async def execute(self, query, params=None, **kwargs):
+        with DB_QUERY_SECONDS.time(timing="db", operation=_operation(query)):
+            return await super().execute(query, params, **kwargs)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        with DB_QUERY_SECONDS.time(timing="db", operation=_operation(query)):
+            return await super().executemany(query, params_seq, **kwargs)
+
+
+async def open_pool() -> AsyncConnectionPool:
+    """Create and open the shared connection pool. Called from the FastAPI lifespan."""
+    global _pool
+    if _pool is None:
+        _pool = AsyncConnectionPool(
+            DB_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            timeout=DB_POOL_TIMEOUT,
+            max_idle=DB_POOL_MAX_IDLE,
+            check=AsyncConnectionPool.check_connection,
+            kwargs={"cursor_factory": TimedCursor},
+            name="app",
+            open=False,
+        )
+        await _pool.open(wait=True)
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_pool() -> AsyncConnectionPool:
+    if _pool is None:
+        raise RuntimeError("Database pool is not open; call open_pool() first.")
+    return _pool
+
+
+@asynccontextmanager
+async def get_connection(timeout: Optional[float] = None):
+    """Borrow a pooled connection. Commits on success and rolls back on error."""
+    async with get_pool().connection(timeout=timeout) as conn:
+        yield conn
+
+
+def pool_is_open() -> bool:
+    return _pool is not None
+
+
+def pool_stats() -> dict:
+    """Pool size and wait counters (``requests_wait_ms``, ``requests_errors``...)."""
+    if _pool is None:
+        return {}
+    return _pool.get_stats()
+
+
+async def create_tables():
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            # Several uvicorn workers run this at startup; serialize the DDL.
+            await cur.execute("SELECT pg_advisory_xact_lock(hashtext('create_tables'))")
+            await cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            await cur.execute(f"""
             CREATE TABLE IF NOT EXISTS documents (
                 id SERIAL PRIMARY KEY,
                 filename TEXT NOT NULL,
                 summary_text TEXT NOT NULL,
-                summary_embedding vector, 
+                summary_embedding vector({EMBEDDING_DIM}), 
                 uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             );
             """)
-            cur.execute("""
+            await cur.execute(f"""
             CREATE TABLE IF NOT EXISTS embeddings (
                 id SERIAL PRIMARY KEY,
                 document_id INTEGER REFERENCES documents(id) ON DELETE CASCADE,
                 chunk TEXT NOT NULL,
-                vector_embedding vector,
+                vector_embedding vector({EMBEDDING_DIM}),
                 chunk_index INTEGER NOT NULL
             );
             """)
-            cur.execute("""
+            await cur.execute("""
             CREATE TABLE IF NOT EXISTS chat_history (
                 code TEXT PRIMARY KEY,
                 message TEXT NOT NULL,
@@ -39,5 +143,222 @@ def create_tables():
                 email_id TEXT NOT NULL
             );
             """)
-        conn.commit()
-    print("Tables created successfully.")
\ No newline at end of file
+            await cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                embedding vector({EMBEDDING_DIM}) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (model, text_hash)
+            );
+            """)
+            await cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                id SERIAL PRIMARY KEY,
+                document_id INTEGER REFERENCES documents(id) ON DELETE CASCADE,
+                query TEXT NOT NULL,
+                query_embedding vector({EMBEDDING_DIM}) NOT NULL,
+                answer TEXT NOT NULL,
+                context TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """)
+            await cur.execute("CREATE INDEX IF NOT EXISTS embedding_cache_created_at_idx ON embedding_cache (created_at)")
+            await cur.execute("CREATE INDEX IF NOT EXISTS answer_cache_document_id_idx ON answer_cache (document_id, created_at)")
+            # Hash of the search options an answer was produced with (added after the table shipped).
+            await cur.execute("ALTER TABLE answer_cache ADD COLUMN IF NOT EXISTS options_hash TEXT")
+            await cur.execute("CREATE INDEX IF NOT EXISTS answer_cache_created_at_idx ON answer_cache (created_at)")
+            await cur.execute("""
+            CREATE TABLE IF NOT EXISTS caption_cache (
+                image_hash TEXT PRIMARY KEY,
+                phash BIGINT,
+                caption TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """)
+            await cur.execute("CREATE INDEX IF NOT EXISTS caption_cache_phash_idx ON caption_cache (phash)")
+            await cur.execute("""
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                progress JSONB,
+                result JSONB,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """)
+            # Content hashes for incremental re-ingestion (columns added after the tables shipped).
+            await cur.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash TEXT")
+            await cur.execute("ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS chunk_hash TEXT")
+            await cur.execute("CREATE INDEX IF NOT EXISTS documents_content_hash_idx ON documents (content_hash)")
+            await cur.execute("CREATE INDEX IF NOT EXISTS documents_filename_idx ON documents (filename)")
+            await cur.execute("CREATE INDEX IF NOT EXISTS embeddings_document_id_idx ON embeddings (document_id)")
+            # Lexical side of hybrid retrieval.
+            await cur.execute(
+                "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS chunk_tsv tsvector "
+                "GENERATED ALWAYS AS (to_tsvector('english'::regconfig, chunk)) STORED"
+            )
+            await cur.execute("CREATE INDEX IF NOT EXISTS embeddings_chunk_tsv_idx ON embeddings USING gin (chunk_tsv)")
+            # Chunk provenance, used by metadata filters in doc_search.
+            await cur.execute(
+                "ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS page_start INTEGER, "
+                "ADD COLUMN IF NOT EXISTS page_end INTEGER, ADD COLUMN IF NOT EXISTS segment_type TEXT, "
+                "ADD COLUMN IF NOT EXISTS char_start INTEGER, ADD COLUMN IF NOT EXISTS char_end INTEGER"
+            )
+            await cur.execute("CREATE INDEX IF NOT EXISTS embeddings_doc_type_page_idx ON embeddings (document_id, segment_type, page_start, page_end)")
+            await cur.execute("CREATE INDEX IF NOT EXISTS embeddings_type_page_idx ON embeddings (segment_type, page_start, page_end)")
+            await ensure_vector_indexes(cur)
+    logger.info("Tables created successfully.")
+
+
+def _vector_index_name(table: str, column: str) -> str:
+    return f"{table}_{column}_{VECTOR_INDEX_TYPE}_idx"
+
+
+def _vector_index_ddl(table: str, column: str, lists: Optional[int] = None) -> str:
+    name = _vector_index_name(table, column)
+    if VECTOR_INDEX_TYPE == "ivfflat":
+        params = f"lists = {lists or IVFFLAT_LISTS}"
+    elif VECTOR_INDEX_TYPE == "hnsw":
+        params = f"m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION}"
+    else:
+        raise ValueError(f"Unsupported VECTOR_INDEX_TYPE: {VECTOR_INDEX_TYPE}")
+    return (
+        f"CREATE INDEX IF NOT EXISTS {name} ON {table} "
+        f"USING {VECTOR_INDEX_TYPE} ({column} vector_cosine_ops) WITH ({params})"
+    )
+
+
+async def ensure_vector_indexes(cur):
+    """Pin vector columns to EMBEDDING_DIM and create the cosine ANN indexes if missing.
+
+    Tables created before the dimension was declared have untyped ``vector``
+    columns, which cannot be indexed; those are altered in place.
+    """
+    for table, column in VECTOR_COLUMNS:
+        await cur.execute(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = %s::regclass AND attname = %s",
+            (table, column),
+        )
+        row = await cur.fetchone()
+        if row and row[0] == "vector":
+            await cur.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE vector({EMBEDDING_DIM})")
+        await cur.execute(_vector_index_ddl(table, column))
+
+
+async def rebuild_vector_indexes():
+    """Drop and rebuild the ANN indexes, e.g. after bulk loads.
+
+    IVFFlat centroids are fixed at build time, so ``lists`` is re-derived from
+    the current row count (rows / 1000, or sqrt(rows) above one million rows).
+    """
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            for table, column in VECTOR_COLUMNS:
+                lists = None
+                if VECTOR_INDEX_TYPE == "ivfflat":
+                    await cur.execute(f"SELECT count(*) FROM {table}")
+                    rows = (await cur.fetchone())[0]
+                    lists = max(1, int(rows ** 0.5) if rows > 1_000_000 else rows // 1000)
+                await cur.execute(f"DROP INDEX IF EXISTS {_vector_index_name(table, column)}")
+                await cur.execute(_vector_index_ddl(table, column, lists))
+                await cur.execute(f"ANALYZE {table}")
+
+
+async def _supports_iterative_scan(cur) -> bool:
+    """Whether the installed pgvector (>= 0.8) knows ``hnsw.iterative_scan``; checked once per process."""
+    global _iterative_scan_supported
+    if _iterative_scan_supported is None:
+        await cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = await cur.fetchone()
+        version = tuple(int(part) for part in row[0].split(".")[:2] if part.isdigit()) if row else ()
+        _iterative_scan_supported = version >= (0, 8)
+        if not _iterative_scan_supported:
+            logger.warning("pgvector %s has no iterative index scans; filtered HNSW searches may return "
+                           "fewer than top_k rows", row[0] if row else "(not installed)")
+    return _iterative_scan_supported
+
+
+async def set_search_params(cur, ef_search: Optional[int] = None, probes: Optional[int] = None):
+    """Apply per-query ANN tuning for the current transaction.
+
+    With HNSW_ITERATIVE_SCAN, filtered queries keep scanning the index instead of
+    post-filtering a fixed ef_search candidate list. ``relaxed_order`` may return
+    rows slightly out of order, so queries must re-sort the rows they keep.
+    """
+    if ef_search:
+        await cur.execute("SELECT set_config('hnsw.ef_search', %s, true)", (str(ef_search),))
+    if probes:
+        await cur.execute("SELECT set_config('ivfflat.probes', %s, true)", (str(probes),))
+    if HNSW_ITERATIVE_SCAN and VECTOR_INDEX_TYPE == "hnsw" and await _supports_iterative_scan(cur):
+        await cur.execute("SELECT set_config('hnsw.iterative_scan', %s, true)", (HNSW_ITERATIVE_SCAN,))
+
+
+def to_vector_literal(vector) -> str:
+    """Render an embedding as a pgvector text literal, e.g. ``[0.1,0.2]``."""
+    return "[" + ",".join(map(str, vector)) + "]"
+
+
+def chunk_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+async def bulk_insert_embeddings(cur, document_id: int, chunks, vectors, batch_size: int = EMBEDDING_INSERT_BATCH_SIZE,
+                                 on_progress: Optional[Callable[[int], None]] = None,
+                                 chunk_indices: Optional[List[int]] = None,
+                                 metadata: Optional[List[dict]] = None) -> dict:
+    """Stream chunks of a document into ``embeddings`` with COPY, ``batch_size`` rows per COPY.
+
+    ``chunk_indices`` defaults to ``0..n-1``. ``metadata`` holds one dict of
+    CHUNK_METADATA_COLUMNS values per chunk. ``on_progress`` is called with the
+    number of rows written after each batch.
+    """
+    start = time.perf_counter()
+    batch_size = max(1, batch_size)
+    if chunk_indices is None:
+        chunk_indices = range(len(chunks))
+    if metadata is None:
+        metadata = [{}] * len(chunks)
+    rows = [
+        (document_id, chunk, to_vector_literal(vector), idx, chunk_hash(chunk),
+         *(meta.get(column) for column in CHUNK_METADATA_COLUMNS))
+        for idx, chunk, vector, meta in zip(chunk_indices, chunks, vectors, metadata)
+    ]
+    columns = ", ".join(("document_id", "chunk", "vector_embedding", "chunk_index", "chunk_hash") + CHUNK_METADATA_COLUMNS)
+    for offset in range(0, len(rows), batch_size):
+        with DB_QUERY_SECONDS.time(timing="db", operation="COPY"):
+            async with cur.copy(f"COPY embeddings ({columns}) FROM STDIN") as copy:
+                for row in rows[offset:offset + batch_size]:
+                    await copy.write_row(row)
+        if on_progress:
+            on_progress(min(offset + batch_size, len(rows)))
+    elapsed = time.perf_counter() - start
+    stats = {
+        "rows": len(rows),
+        "batches": -(-len(rows) // batch_size),
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(len(rows) / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    logger.info("Inserted %(rows)d embedding rows in %(batches)d batches (%(rows_per_sec)s rows/s)", stats)
+    return stats
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+
+    async def _main(command: str):
+        await open_pool()
+        try:
+            if command == "reindex":
+                await rebuild_vector_indexes()
+            else:
+                await create_tables()
+        finally:
+            await close_pool()
+
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "create"))
@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .utils import (
+    iter_docx_text,
+    iter_text_file,
+    extract_text_from_pdf,
+    extract_rich_pdf_segments,
+)
+from .db import get_connection, to_vector_literal, chunk_hash
+from .vector_store import get_vector_store, plan_chunk_reuse
+from app.util.chunk_summary import extractive_summary
+from app.util.chunker import iter_segment_records, iter_text_records
+from app.util.embedding_client import get_embedding
+from app.util.embedding_pipeline import embed_chunks
+from app.util.answer_cache import invalidate_document
+from app.util.metrics import INGEST_STAGE_SECONDS
+
+SUPPORTED_EXTENSIONS = ('.txt', '.docx', '.pdf')
+
+ProgressCallback = Callable[..., None]
+
+
+def _noop_progress(stage: Optional[str] = None, **counters):
+    pass
+
+
+class StageTimer:
+    """Progress callback wrapper that records the seconds spent in each stage."""
+
+    def __init__(self, progress: ProgressCallback):
+        self.progress = progress
+        self.timings: Dict[str, float] = {}
+        self.stage: Optional[str] = None
+        self.started = time.perf_counter()
+
+    def _close(self):
+        if self.stage is not None:
+            elapsed = time.perf_counter() - self.started
+            INGEST_STAGE_SECONDS.observe(elapsed, stage=self.stage)
+            self.timings[self.stage] = round(self.timings.get(self.stage, 0.0) + elapsed, 4)
+
+    def __call__(self, stage: Optional[str] = None, **counters):
+        if stage is not None and stage != self.stage:
+            self._close()
+            self.stage, self.started = stage, time.perf_counter()
+        self.progress(stage=stage, **counters)
+
+    def split(self, stage: str, seconds: float):
+        """Book ``seconds`` of the current stage's time under ``stage`` (for interleaved work)."""
+        INGEST_STAGE_SECONDS.observe(seconds, stage=stage)
+        self.timings[stage] = round(self.timings.get(stage, 0.0) + seconds, 4)
+        self.started += seconds
+
+    def finish(self) -> Dict[str, float]:
+        self._close()
+        self.stage = None
+        return self.timings
+
+
+def _timed(iterable, totals: Dict[str, float]):
+    """Yield from ``iterable``, adding the time spent producing items to ``totals["seconds"]``."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            totals["seconds"] = totals.get("seconds", 0.0) + time.perf_counter() - start
+        yield item
+
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def find_document_by_hash(content_hash: str) -> Optional[int]:
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT id FROM documents WHERE content_hash = %s ORDER BY id DESC LIMIT 1", (content_hash,))
+            row = await cur.fetchone()
+    return row[0] if row else None
+
+
+async def document_exists(document_id: int) -> bool:
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT 1 FROM documents WHERE id = %s", (document_id,))
+            return await cur.fetchone() is not None
+
+
+async def ingest_file(file_path: str, filename: str, text_extract_only: bool = False,
+                      extract_workers: Optional[int] = None, content_hash: Optional[str] = None,
+                      replaces: Optional[int] = None,
+                      progress: ProgressCallback = _noop_progress) -> Dict[str, Any]:
+    """Extract, chunk, embed, summarize and store one uploaded file.
+
+    A byte-identical file returns the existing document. Otherwise a new
+    document is created, unless ``replaces`` names an existing document: that
+    document is then updated in place as a new version. Chunks whose hash is
+    unchanged keep their rows and vectors, and only new chunks are embedded
+    and inserted. The document row is locked while it is rewritten, so
+    concurrent revisions of one document are applied one after the other.
+
+    ``progress(stage=..., **counters)`` is called as stages start and advance
+    (pages_extracted, images_captioned, chunks_embedded, rows_written...).
+    Seconds spent per stage are returned under ``timings``.
+    """
+    content_hash = content_hash or file_hash(file_path)
+    existing_id = await find_document_by_hash(content_hash)
+    if existing_id is not None:
+        return {"document_id": existing_id, "duplicate": True}
+
+    progress = StageTimer(progress)
+    lowered = filename.lower()
+    extract_stats: Dict[str, Any] = {}
+    progress(stage="extract")
+    if lowered.endswith(('.txt', '.docx')):
+        # Text is read and chunked as a stream; the whole document is never held as one string.
+        # Reading and chunking interleave, so the time spent reading is measured inside the
+        # stream and the rest of the pass is booked as the chunk stage.
+        pieces = iter_text_file if lowered.endswith('.txt') else iter_docx_text
+        read: Dict[str, float] = {}
+        started = time.perf_counter()
+        records = await asyncio.to_thread(lambda: list(iter_text_records(_timed(pieces(file_path), read))))
+        progress.split("chunk", max(0.0, time.perf_counter() - started - read.get("seconds", 0.0)))
+    elif lowered.endswith(".pdf"):
+        segments = await extract_rich_pdf_segments(
+            file_path, text_extract_only, stats=extract_stats, workers=extract_workers,
+            on_pages=lambda done, total: progress(pages_extracted=done, pages_total=total),
+            on_captions=lambda done, total: progress(stage="caption", images_captioned=done, images_total=total),
+        )
+        progress(stage="chunk")
+        # Chunking tokenizes every segment; like the text path, keep it off the event loop.
+        if segments:
+            records = await asyncio.to_thread(lambda: list(iter_segment_records(segments)))
+        else:
+            records = await asyncio.to_thread(lambda: list(iter_text_records([extract_text_from_pdf(file_path)])))
+    else:
+        records = []
+    chunks = [text for text, _ in records]
+    chunk_metadata = [meta for _, meta in records]
+
+    store = get_vector_store()
+    # Snapshot of the current version, read without a lock so unchanged chunks skip embedding.
+    previous_chunks = await store.existing_chunks(replaces) if replaces is not None else {}
+    hashes = await asyncio.to_thread(lambda: [chunk_hash(chunk) for chunk in chunks])
+    plan = plan_chunk_reuse(hashes, previous_chunks)
+    vectors = list(plan.vectors)
+    retained, new_indices = plan.retained, plan.new_indices
+
+    progress(stage="embed", chunks_total=len(chunks))
+    new_vectors, embedding_stats = await embed_chunks(
+        [chunks[i] for i in new_indices],
+        on_progress=lambda done: progress(chunks_embedded=len(retained) + done),
+    )
+    for idx, vector in zip(new_indices, new_vectors):
+        vectors[idx] = vector
+
+    progress(stage="summarize")
+    summary_text = await extractive_summary(chunks, vectors, num_summary_chunks=5)
+    summary_embedding = await get_embedding(summary_text)
+
+    progress(stage="db_write")
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            if replaces is None:
+                await cur.execute("INSERT into documents (filename, summary_text, summary_embedding, content_hash) VALUES (%s, %s, %s::vector, %s) RETURNING id", (filename, summary_text, to_vector_literal(summary_embedding), content_hash))
+                doc_id = (await cur.fetchone())[0]
+            else:
+                doc_id = replaces
+                # Held until commit: a concurrent revision of this document waits here.
+                await cur.execute("SELECT id FROM documents WHERE id = %s FOR UPDATE", (doc_id,))
+                if await cur.fetchone() is None:
+                    raise ValueError(f"Document {doc_id} no longer exists")
+                await cur.execute(
+                    "UPDATE documents SET filename = %s, summary_text = %s, summary_embedding = %s::vector, "
+                    "content_hash = %s, uploaded_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    (filename, summary_text, to_vector_literal(summary_embedding), content_hash, doc_id),
+                )
+            await invalidate_document(cur, doc_id)
+        if replaces is not None:
+            # The snapshot may be stale if another revision committed meanwhile; re-plan
+            # against the locked rows. Every chunk already has a vector in ``vectors``.
+            plan = plan_chunk_reuse(hashes, await store.existing_chunks(doc_id, conn=conn))
+        insert_stats = await store.write_chunks(
+            doc_id, chunks, vectors, hashes, plan, conn=conn, metadata=chunk_metadata,
+            on_progress=lambda done: progress(rows_written=done),
+        )
+
+    return {
+        "document_id": doc_id,
+        "num_chunks": len(chunks),
+        "revision": replaces is not None,
+        "reused_chunks": len(plan.retained),
+        "new_chunks": len(plan.new_indices),
+        "deleted_chunks": len(plan.stale_refs),
+        "embedding": embedding_stats,
+        "db_write": insert_stats,
+        "timings": progress.finish(),
+        **extract_stats,
+    }
@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from psycopg.types.json import Jsonb
+
+from .db import get_connection
+from .ingest import ingest_file
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "ai-doc-search-uploads"))
+UPLOAD_READ_CHUNK_SIZE = int(os.getenv("UPLOAD_READ_CHUNK_SIZE", str(1024 * 1024)))
+# Minimum seconds between progress writes to the jobs table within one stage.
+JOB_PROGRESS_FLUSH_INTERVAL = float(os.getenv("JOB_PROGRESS_FLUSH_INTERVAL", "1.0"))
+
+_queue: Optional[asyncio.Queue] = None
+_workers: list = []
+_jobs: Dict[str, Dict[str, Any]] = {}
+
+INTERRUPTED_ERROR = "Interrupted by server shutdown; upload the file again."
+
+
+async def spool_upload(upload, suffix: str):
+    """Copy an UploadFile to the spool directory in fixed-size chunks.
+
+    Returns ``(path, sha256 hex digest)``; the hash is computed while copying.
+    """
+    os.makedirs(INGEST_SPOOL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=INGEST_SPOOL_DIR)
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                block = await upload.read(UPLOAD_READ_CHUNK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                out.write(block)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest()
+
+
+class JobProgress:
+    """Mutable per-stage progress of one ingestion job, mirrored to ``ingestion_jobs``.
+
+    Updates are cheap and synchronous; writes to Postgres happen on stage
+    changes and at most every JOB_PROGRESS_FLUSH_INTERVAL seconds otherwise.
+    """
+
+    def __init__(self, job: Dict[str, Any]):
+        self.job = job
+        self._last_flush = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def __call__(self, stage: Optional[str] = None, **counters):
+        changed_stage = stage is not None and stage != self.job["stage"]
+        if stage is not None:
+            self.job["stage"] = stage
+        self.job["progress"].update(counters)
+        if changed_stage or time.monotonic() - self._last_flush >= JOB_PROGRESS_FLUSH_INTERVAL:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        self._last_flush = time.monotonic()
+        self._flush_task = asyncio.create_task(save_job(self.job))
+
+    async def drain(self):
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+
+
+async def save_job(job: Dict[str, Any]):
+    try:
+        async with get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    INSERT INTO ingestion_jobs (id, filename, status, stage, progress, result, error, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                    ON CONFLICT (id) DO UPDATE SET status = EXCLUDED.status, stage = EXCLUDED.stage,
+                        progress = EXCLUDED.progress, result = EXCLUDED.result, error = EXCLUDED.error,
+                        updated_at = CURRENT_TIMESTAMP
+                    """,
+                    (job["id"], job["filename"], job["status"], job["stage"], Jsonb(job["progress"]),
+                     Jsonb(job["result"]) if job["result"] is not None else None, job["error"]),
+                )
+    except Exception as e:
+        logger.warning("Could not persist job %s: %s", job["id"], e)
+
+
+async def enqueue_job(file_path: str, filename: str, **options) -> Dict[str, Any]:
+    job = {
+        "id": uuid.uuid4().hex,
+        "filename": filename,
+        "status": "queued",
+        "stage": "queued",
+        "progress": {},
+        "result": None,
+        "error": None,
+    }
+    _jobs[job["id"]] = job
+    await save_job(job)
+    await _queue.put((job, file_path, options))
+    return job
+
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Job status from this worker's memory, else from the jobs table (another worker's job)."""
+    if job_id in _jobs:
+        return _jobs[job_id]
+    async with get_connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT id, filename, status, stage, progress, result, error, created_at, updated_at "
+                "FROM ingestion_jobs WHERE id = %s",
+                (job_id,),
+            )
+            row = await cur.fetchone()
+    if row is None:
+        return None
+    keys = ("id", "filename", "status", "stage", "progress", "result", "error", "created_at", "updated_at")
+    return dict(zip(keys, row))
+
+
+def _remove_spool(file_path: str):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+
+def _mark_interrupted(job: Dict[str, Any]):
+    job["status"] = "failed"
+    job["stage"] = "interrupted"
+    job["error"] = INTERRUPTED_ERROR
+
+
+async def _run_job(job: Dict[str, Any], file_path: str, options: Dict[str, Any]):
+    progress = JobProgress(job)
+    job["status"] = "running"
+    started = time.perf_counter()
+    try:
+        job["result"] = await ingest_file(file_path, job["filename"], progress=progress, **options)
+        job["status"] = "completed"
+        job["stage"] = "done"
+    except asyncio.CancelledError:
+        logger.warning("Ingestion job %s interrupted", job["id"])
+        _mark_interrupted(job)
+        raise
+    except Exception as e:
+        logger.exception("Ingestion job %s failed", job["id"])
+        job["status"] = "failed"
+        job["error"] = str(e)
+    finally:
+        job["progress"]["seconds"] = round(time.perf_counter() - started, 3)
+        _remove_spool(file_path)
+        await progress.drain()
+        await save_job(job)
+
+
+async def _worker():
+    while True:
+        job, file_path, options = await _queue.get()
+        try:
+            await _run_job(job, file_path, options)
+        finally:
+            _queue.task_done()
+            # Keep memory bounded; finished jobs stay queryable through the table.
+            _jobs.pop(job["id"], None)
+
+
+def start_workers(concurrency: int = INGEST_WORKERS):
+    global _queue
+    _queue = asyncio.Queue()
+    for _ in range(max(1, concurrency)):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def stop_workers():
+    """Cancel the workers; running and still-queued jobs are recorded as failed
+    (interrupted) so status pollers stop, and their spool files are removed."""
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    while _queue is not None and not _queue.empty():
+        job, file_path, _ = _queue.get_nowait()
+        _mark_interrupted(job)
+        _remove_spool(file_path)
+        await save_job(job)
+        _jobs.pop(job["id"], None)
+
+
+def queue_depth() -> int:
+    return _queue.qsize() if _queue is not None else 0
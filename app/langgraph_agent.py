@@ -1,15 +1,21 @@
-import json
-from typing import AsyncGenerator
-import psycopg2
+from typing import AsyncGenerator, Optional
 import logging
 from app.agent_nodes.agent_state import AgentState
 from app.agent_nodes.entry_router import entry_router
-from app.agent_nodes.llm_synthesis import llm_synthesis
-from app.agent_nodes.doc_search import doc_search
+from app.agent_nodes.llm_synthesis import llm_synthesis, FALLBACK_ANSWER
+from app.agent_nodes.doc_search import (
+    doc_search, SPECULATIVE_RETRIEVAL, start_speculative_search, cancel_speculative_search,
+)
+from app.agent_nodes.agent_events import EventSink, bind_event_sink, emit_event, format_sse
+from app.util.embedding_client import get_embedding
+from app.util.answer_cache import ANSWER_CACHE_ENABLED, lookup_answer, options_hash, store_answer
+from app.util.metrics import AGENT_NODE_SECONDS, bind_request_timings
 from langgraph.graph import StateGraph, END
 import asyncio
+import time
 
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 AGENT_NODE_FUNCS = {
     "entry_router": entry_router,
@@ -17,77 +23,157 @@ AGENT_NODE_FUNCS = {
     "llm_synthesis": llm_synthesis
 }
 
-async def agent_infer_langgraph_stream(conn, document_id: int, query: str, top_k: int) -> AsyncGenerator[str, None]:
-    state: AgentState = {
-        "query": query,
-        "document_id": str(document_id),
-        "top_k": top_k,
-        "step_results": {}
-    }
+# State keys too bulky to echo in every enter/exit event.
+_UNSTREAMED_STATE_KEYS = ("query_embedding",)
 
-    stream_queue = asyncio.Queue()
 
-    # Initialize the StateGraph
-    graph = StateGraph(AgentState)
+def public_state(state: AgentState) -> dict:
+    public = {k: v for k, v in state.items() if k not in _UNSTREAMED_STATE_KEYS}
+    if public.get("retrieved_chunks"):
+        public["retrieved_chunks"] = [{k: v for k, v in hit.items() if k != "vector"} for hit in public["retrieved_chunks"]]
+    return public
+
+
+def stream_node(name, func):
+    if asyncio.iscoroutinefunction(func):
+        async def wrapper(state: AgentState, *args, **kwargs) -> dict:
+            emit_event({"event":"enter", "node": name, "state": public_state(state)})
+            with AGENT_NODE_SECONDS.time(timing=f"node.{name}", node=name):
+                result = await func(state, *args, **kwargs)
+            emit_event({"event":"exit", "node": name, "state": public_state(state), "result": public_state(result)})
+            return result
+    else:
+        def wrapper(state: AgentState, *args, **kwargs) -> dict:
+            emit_event({"event":"enter", "node": name, "state": public_state(state)})
+            with AGENT_NODE_SECONDS.time(timing=f"node.{name}", node=name):
+                result = func(state, *args, **kwargs)
+            emit_event({"event":"exit", "node": name, "state": public_state(state), "result": public_state(result)})
+            return result
+    return wrapper
+
+
+def route_from_entry_router(state: AgentState) -> list[str]:
+    if not state.get("sequence"):
+        step_results = state.get("step_results", {})
+        route_result = step_results.get("entry_router", {})
+        if route_result and "sequence" in route_result:
+            state["sequence"] = route_result["sequence"]
+    sequence = state.get("sequence", [])
+    if "doc_search" not in sequence:
+        cancel_speculative_search()
+    if not sequence:
+        return END
+    return sequence[0]
+
+
+def route_sequence(state: AgentState, prev_node: str) -> list[str]:
+    sequence = state.get("sequence", [])
+    if prev_node in sequence:
+        idx = sequence.index(prev_node)
+        if idx + 1 < len(sequence):
+            return [sequence[idx + 1]]
+    return END
 
-    def stream_node(name):
-        def decorator(func):
-            if(asyncio.iscoroutinefunction(func)):
-                async def wrapper(state: AgentState, *args, **kwargs) -> dict:
-                    await stream_queue.put({"event":"enter", "node": name, "state": dict(state)})
-                    result = await func(state, *args, **kwargs)
-                    await stream_queue.put({"event":"exit", "node": name, "state": dict(state), "result": result})
-                    return result
-                return wrapper
-            else:
-                def wrapper(state: AgentState, *args, **kwargs) -> dict:
-
-                    stream_queue.put_nowait({"event":"enter", "node": name, "state": dict(state)})
-                    result = func(state, *args, **kwargs)
-                    stream_queue.put_nowait({"event":"exit", "node": name, "state": dict(state), "result": result})
-                    return result
-                return wrapper
-        return decorator
 
+def build_agent_graph():
+    graph = StateGraph(AgentState)
     for name, func in AGENT_NODE_FUNCS.items():
-        graph.add_node(name,stream_node(name)(func))
+        graph.add_node(name, stream_node(name, func))
     graph.set_entry_point("entry_router")
 
-    def route_from_entry_router(state: AgentState) -> list[str]:
-        if not state.get("sequence"):
-            step_results = state.get("step_results", {})
-            route_result = step_results.get("entry_router", {})
-            if route_result and "sequence" in route_result:
-                state["sequence"] = route_result["sequence"]
-        sequence = state.get("sequence", [])
-        if not sequence:
-            return END
-        return sequence[0]
-
-    def route_sequence(state: AgentState, prev_node: str) -> list[str]:
-        sequence = state.get("sequence", [])
-        if prev_node in sequence:
-            idx = sequence.index(prev_node)
-            if idx + 1 < len(sequence):
-                return [sequence[idx + 1]]
-        return END
-    
     graph.add_conditional_edges("entry_router", route_from_entry_router)
-    
     for name in AGENT_NODE_FUNCS:
         if name != "entry_router":
             graph.add_conditional_edges(name, lambda state, prev_node=name: route_sequence(state, prev_node))
 
-    compiled = graph.compile()  
+    return graph.compile()
+
+
+# Compiled once at import (application startup) and shared by every request;
+# per-request streaming goes through the context-scoped event sink.
+AGENT_GRAPH = build_agent_graph()
+
+
+async def agent_infer_langgraph_stream(document_id: Optional[int], query: str, top_k: int,
+                                       use_cache: bool = True, speculative: Optional[bool] = None,
+                                       timings: bool = False, **search_options) -> AsyncGenerator[str, None]:
+    """Run the agent for one question and yield SSE frames.
+
+    ``search_options`` (ef_search, probes, search_mode, top_docs, chunks_per_doc...)
+    are copied into the agent state for doc_search. With ``speculative`` (default
+    SPECULATIVE_RETRIEVAL) retrieval, including the query embedding when the answer
+    cache is not consulted, starts alongside entry_router and is cancelled if the
+    chosen route does not include doc_search. The stream always ends with a
+    ``completed`` frame, or an ``error`` frame if the run fails. With ``timings`` the
+    completed event carries this request's node, OpenAI and DB time in seconds.
+    """
+    started = time.perf_counter()
+    request_timings = bind_request_timings()
+
+    def completed(event: dict) -> dict:
+        if timings:
+            event["timings"] = {**request_timings, "total": round(time.perf_counter() - started, 6)}
+        return event
+
+    speculative = SPECULATIVE_RETRIEVAL if speculative is None else speculative
+    use_cache = use_cache and ANSWER_CACHE_ENABLED
+    # Answers are only reused for the same top_k, search and filter options.
+    options_key = options_hash({"top_k": top_k, **search_options})
+    sink = EventSink()
 
     async def run_graph():
-        final_state = await compiled.ainvoke(state, conn=conn)
-        await stream_queue.put({"status":"completed", "result": final_state.get("llm_synthesis"), "context": final_state.get("context")})
+        bind_event_sink(sink)
+        search_task = None
+        try:
+            # The embedding is only needed up front for the cache lookup; otherwise
+            # retrieve() embeds the query itself, speculatively alongside entry_router.
+            query_vector = await get_embedding(query) if use_cache else None
+            if use_cache:
+                cached = await lookup_answer(document_id, query_vector, options_key)
+                if cached:
+                    sink.emit({"event": "cache_hit", "similarity": cached["similarity"], "cached_query": cached["query"]})
+                    sink.emit(completed({"status":"completed", "result": cached["answer"], "context": cached["context"], "cached": True}))
+                    return
+
+            state: AgentState = {
+                "query": query,
+                "query_embedding": query_vector,
+                "document_id": str(document_id) if document_id is not None else None,
+                "top_k": top_k,
+                "step_results": {},
+                **search_options,
+            }
+            search_task = start_speculative_search(state) if speculative else None
+            try:
+                final_state = await AGENT_GRAPH.ainvoke(state)
+            finally:
+                if search_task is not None:
+                    if not search_task.done():
+                        search_task.cancel()
+                    elif not search_task.cancelled():
+                        search_task.exception()  # mark an unused failure as retrieved
+            answer = final_state.get("llm_synthesis")
+            if use_cache and answer and answer != FALLBACK_ANSWER:
+                try:
+                    await store_answer(document_id, query, query_vector, options_key, answer, final_state.get("context"))
+                except Exception:
+                    logger.exception("Could not cache answer")
+            terminal = completed({"status":"completed", "result": answer, "context": final_state.get("context")})
+        except Exception as e:
+            logger.exception("Agent run failed")
+            terminal = completed({"status": "error", "error": str(e), "result": FALLBACK_ANSWER})
+        sink.emit(terminal)
+
+    def ensure_terminal(task: asyncio.Task):
+        # Last resort if run_graph was cancelled or failed before emitting: never leave the stream open.
+        if task.cancelled() or task.exception() is not None:
+            sink.emit({"status": "error", "error": "agent run aborted", "result": FALLBACK_ANSWER})
 
     graph_task = asyncio.create_task(run_graph())
+    graph_task.add_done_callback(ensure_terminal)
 
     while True:
-        event = await stream_queue.get()
-        yield json.dumps(event) + "\n\n"
-        if event.get("status") == "completed":
-            break
\ No newline at end of file
+        event = await sink.get()
+        yield format_sse(event)
+        if event.get("status") in ("completed", "error"):
+            break
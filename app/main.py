@@ -1,13 +1,30 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import uvicorn
 from app.api import router
-from .db import create_tables
+from .db import create_tables, open_pool, close_pool
+from .util.openai_client import aclose_clients
+from .utils import shutdown_process_pool
+from .jobs import start_workers, stop_workers
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await open_pool()
+    await create_tables()
+    start_workers()
+    try:
+        yield
+    finally:
+        await stop_workers()
+        await close_pool()
+        await aclose_clients()
+        shutdown_process_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(router)
-create_tables()
 
 @app.get("/")
 async def read_root():
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Minimum seconds between purges of expired rows, run from store_answer.
+ANSWER_CACHE_PURGE_INTERVAL = float(os.getenv("ANSWER_CACHE_PURGE_INTERVAL", "300"))
+
+counters = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0, "purged": 0, "errors": 0}
+_last_purge = 0.0
+
+
+def options_hash(options: dict) -> str:
+    """Stable key for the answer-affecting request options (top_k, search and filter
+    settings); unset (None) options are left out so defaults share one key."""
+    normalized = {k: sorted(v) if isinstance(v, (list, tuple, set)) else v
+                  for k, v in options.items() if v is not None}
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+async def lookup_answer(document_id: Optional[int], query_vector: list, options_key: str,
+                        threshold: float = ANSWER_CACHE_THRESHOLD) -> Optional[dict]:
+    """Return the cached answer of the most similar earlier question about ``document_id``
+    asked with the same options (``options_key``, see ``options_hash``), if its cosine
+    similarity is at least ``threshold`` and it is younger than the TTL."""
+    try:
+        async with db.get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    SELECT query, answer, context, 1 - (query_embedding <=> %s::vector) AS similarity
+                    FROM answer_cache
+                    WHERE document_id IS NOT DISTINCT FROM %s
+                      AND options_hash = %s
+                      AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    ORDER BY query_embedding <=> %s::vector
+                    LIMIT 1
+                    """,
+                    (db.to_vector_literal(query_vector), document_id, options_key, ANSWER_CACHE_TTL, db.to_vector_literal(query_vector)),
+                )
+                row = await cur.fetchone()
+    except Exception as e:
+        counters["errors"] += 1
+        logger.warning("Answer cache lookup failed: %s", e)
+        return None
+    if row is None or row[3] < threshold:
+        counters["misses"] += 1
+        return None
+    counters["hits"] += 1
+    return {"query": row[0], "answer": row[1], "context": row[2], "similarity": float(row[3])}
+
+
+async def store_answer(document_id: Optional[int], query: str, query_vector: list, options_key: str,
+                       answer: str, context: Optional[str]):
+    """Cache an answer; also deletes rows older than the TTL, at most every ANSWER_CACHE_PURGE_INTERVAL."""
+    global _last_purge
+    try:
+        async with db.get_connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "INSERT INTO answer_cache (document_id, query, query_embedding, options_hash, answer, context) "
+                    "VALUES (%s, %s, %s::vector, %s, %s, %s)",
+                    (document_id, query, db.to_vector_literal(query_vector), options_key, answer, context),
+                )
+                if time.monotonic() - _last_purge >= ANSWER_CACHE_PURGE_INTERVAL:
+                    _last_purge = time.monotonic()
+                    await cur.execute(
+                        "DELETE FROM answer_cache WHERE created_at <= CURRENT_TIMESTAMP - make_interval(secs => %s)",
+                        (ANSWER_CACHE_TTL,),
+                    )
+                    counters["purged"] += cur.rowcount
+        counters["stores"] += 1
+    except Exception as e:
+        counters["errors"] += 1
+        logger.warning("Answer cache write failed: %s", e)
+
+
+async def invalidate_document(cur, document_id: int):
+    """Drop cached answers for ``document_id`` and the cross-document answers
+    (``document_id IS NULL``) it may have changed; runs inside the caller's transaction."""
+    await cur.execute("DELETE FROM answer_cache WHERE document_id = %s OR document_id IS NULL", (document_id,))
+    counters["invalidations"] += 1
+
+
+def stats() -> dict:
+    lookups = counters["hits"] + counters["misses"]
+    return {**counters, "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0}
@@ -0,0 +1,113 @@
+import hashlib
+import io
+import logging
+import os
+from typing import Dict, Iterable, Optional
+
+from PIL import Image
+
+from app import db
+from app.util.embedding_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+CAPTION_CACHE_SIZE = int(os.getenv("CAPTION_CACHE_SIZE", "5000"))
+CAPTION_CACHE_TTL = float(os.getenv("CAPTION_CACHE_TTL", "604800"))
+CAPTION_CACHE_PERSIST = os.getenv("CAPTION_CACHE_PERSIST", "true").lower() in ("1", "true", "yes")
+# Perceptual-hash mode also treats visually near-identical crops (re-encoded
+# logos, slightly shifted header bands) as duplicates.
+CAPTION_CACHE_PHASH = os.getenv("CAPTION_CACHE_PHASH", "false").lower() in ("1", "true", "yes")
+# Hamming distance for near-duplicates within one document. Lookups in the
+# caption_cache table only match an identical pHash (an indexed equality, not a scan).
+CAPTION_PHASH_MAX_DISTANCE = int(os.getenv("CAPTION_PHASH_MAX_DISTANCE", "4"))
+
+
+def content_hash(png: bytes) -> str:
+    return hashlib.sha256(png).hexdigest()
+
+
+def perceptual_hash(png: bytes) -> int:
+    """64-bit difference hash (dHash) of the image, as a signed int for BIGINT storage."""
+    img = Image.open(io.BytesIO(png)).convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = list(img.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+
+class CaptionCache:
+    """Captions keyed by crop content; in-process LRU in front of the ``caption_cache`` table."""
+
+    def __init__(self, max_size: int = CAPTION_CACHE_SIZE, ttl: float = CAPTION_CACHE_TTL,
+                 persist: bool = CAPTION_CACHE_PERSIST):
+        self.memory = LRUCache(max_size, ttl)
+        self.persist = persist
+
+    def _db_enabled(self) -> bool:
+        return self.persist and db.pool_is_open()
+
+    async def get_many(self, keys: Iterable[str], phashes: Optional[Dict[str, int]] = None) -> Dict[str, str]:
+        """Captions for the given content hashes. With ``phashes`` (content hash -> pHash),
+        stored captions of crops with exactly the same perceptual hash also count as hits;
+        unlike deduplication within a document, no Hamming distance is allowed here."""
+        found = {}
+        for key in keys:
+            caption = self.memory.get(key)
+            if caption is not None:
+                found[key] = caption
+        missing = [k for k in keys if k not in found]
+        if not missing or not self._db_enabled():
+            return found
+        try:
+            async with db.get_connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(
+                        "SELECT image_hash, caption FROM caption_cache WHERE image_hash = ANY(%s)", (missing,))
+                    for key, caption in await cur.fetchall():
+                        found[key] = caption
+                    if phashes:
+                        by_phash = {}
+                        for key in missing:
+                            if key not in found and key in phashes:
+                                by_phash.setdefault(phashes[key], []).append(key)
+                        if by_phash:
+                            await cur.execute(
+                                "SELECT DISTINCT ON (phash) phash, caption FROM caption_cache WHERE phash = ANY(%s)",
+                                (list(by_phash),))
+                            for phash, caption in await cur.fetchall():
+                                for key in by_phash.get(phash, []):
+                                    found[key] = caption
+        except Exception as e:
+            logger.warning("Caption cache lookup failed: %s", e)
+        for key in missing:
+            if key in found:
+                self.memory.put(key, found[key])
+        return found
+
+    async def put_many(self, captions: Dict[str, str], phashes: Optional[Dict[str, int]] = None):
+        for key, caption in captions.items():
+            self.memory.put(key, caption)
+        if not captions or not self._db_enabled():
+            return
+        phashes = phashes or {}
+        try:
+            async with db.get_connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.executemany(
+                        "INSERT INTO caption_cache (image_hash, phash, caption) VALUES (%s, %s, %s) "
+                        "ON CONFLICT (image_hash) DO NOTHING",
+                        [(key, phashes.get(key), caption) for key, caption in captions.items()],
+                    )
+        except Exception as e:
+            logger.warning("Caption cache write failed: %s", e)
+
+
+caption_cache = CaptionCache()
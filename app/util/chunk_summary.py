@@ -1,52 +1,68 @@
 # embedding_summary.py
 
+import asyncio
+import logging
+import os
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from .openai_client import get_chat_content
 
+logger = logging.getLogger(__name__)
 
-def extractive_summary(chunks, embeddings, num_summary_chunks=5):
+# Above this many chunks, summary selection switches to sampled MiniBatchKMeans.
+SUMMARY_MINIBATCH_THRESHOLD = int(os.getenv("SUMMARY_MINIBATCH_THRESHOLD", "1000"))
+SUMMARY_MAX_FIT_SAMPLES = int(os.getenv("SUMMARY_MAX_FIT_SAMPLES", "4000"))
+SUMMARY_MINIBATCH_SIZE = int(os.getenv("SUMMARY_MINIBATCH_SIZE", "1024"))
+SUMMARY_KMEANS_N_INIT = int(os.getenv("SUMMARY_KMEANS_N_INIT", "1"))
+
+
+async def extractive_summary(chunks, embeddings, num_summary_chunks=5):
     """
     Generate an extractive summary from chunk embeddings using KMeans clustering.
+    Falls back to the selected chunks themselves if the LLM summary fails.
     """
     if len(chunks) == 0 or len(embeddings) == 0:
         return ""
+    # Clustering is CPU-bound; keep it off the event loop.
+    summary_indices = await asyncio.to_thread(select_summary_indices, chunks, embeddings, num_summary_chunks)
+    extract = "\n\n".join(chunks[i] for i in summary_indices)
+    return await summary(extract) or extract
+
+
+def select_summary_indices(chunks, embeddings, num_summary_chunks=5):
+    """
+    Indices (in document order) of the chunks closest to each cluster centroid.
 
-    # Ensure embeddings is a 2D NumPy array
-    embeddings = np.array(embeddings)
+    Small documents use KMeans; above SUMMARY_MINIBATCH_THRESHOLD chunks,
+    MiniBatchKMeans is fitted on at most SUMMARY_MAX_FIT_SAMPLES sampled rows
+    and every chunk is then assigned to its nearest centroid.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
     if embeddings.ndim == 1:
         embeddings = embeddings.reshape(len(chunks), -1)
-    
-    num_summary_chunks = min(num_summary_chunks, len(chunks))
-    
-    # KMeans clustering
-    from sklearn.cluster import KMeans
-    kmeans = KMeans(n_clusters=num_summary_chunks, random_state=42)
-    kmeans.fit(embeddings)
-    cluster_centers = kmeans.cluster_centers_
-    labels = kmeans.labels_
-    
-    # Function to pick the chunk closest to cluster centroid
-    def closest_chunk_to_centroid(cluster_idx):
-        cluster_chunks_idx = np.where(labels == cluster_idx)[0]
-        if len(cluster_chunks_idx) == 0:
-            return None
-        cluster_embeddings = embeddings[cluster_chunks_idx]
-        distances = np.linalg.norm(cluster_embeddings - cluster_centers[cluster_idx], axis=1)
-        closest_idx_in_cluster = cluster_chunks_idx[np.argmin(distances)]
-        return closest_idx_in_cluster
-
-    summary_indices = []
-    for i in range(num_summary_chunks):
-        idx = closest_chunk_to_centroid(i)
-        if idx is not None:
-            summary_indices.append(idx)
-
-    summary_chunks = [chunks[i] for i in summary_indices]
-    return summary("\n\n".join(summary_chunks))
-
-
-def summary(summary_chunks):
+    n = len(embeddings)
+    if n <= num_summary_chunks:
+        return list(range(n))
+
+    if n <= SUMMARY_MINIBATCH_THRESHOLD:
+        model = KMeans(n_clusters=num_summary_chunks, n_init=SUMMARY_KMEANS_N_INIT, random_state=42)
+        labels = model.fit_predict(embeddings)
+    else:
+        rng = np.random.default_rng(42)
+        sample = embeddings[rng.choice(n, SUMMARY_MAX_FIT_SAMPLES, replace=False)] if n > SUMMARY_MAX_FIT_SAMPLES else embeddings
+        model = MiniBatchKMeans(n_clusters=num_summary_chunks, n_init=SUMMARY_KMEANS_N_INIT, random_state=42,
+                                batch_size=SUMMARY_MINIBATCH_SIZE)
+        model.fit(sample)
+        labels = model.predict(embeddings)
+
+    # Closest member of every cluster in one pass: sort by (cluster, distance), take each cluster's first row.
+    distances = np.linalg.norm(embeddings - model.cluster_centers_[labels], axis=1)
+    order = np.lexsort((distances, labels))
+    _, first = np.unique(labels[order], return_index=True)
+    return sorted(int(i) for i in order[first])
+
+
+async def summary(summary_chunks):
     system_prompt = (
         """
         You are an AI assistant specialized in generating concise and accurate executive summaries for documents. 
@@ -66,14 +82,15 @@ def summary(summary_chunks):
         """
     )
     try:
-        answer = get_chat_content(
+        answer = await get_chat_content(
             messages=[{"role": "system", "content": system_prompt},
                       {"role": "user", "content": f"chunks of documnet: {summary_chunks}"}],
             model="sonar", max_retries=3, temperature=0.7, max_tokens=4096
         )
         return answer
-    except Exception as e:
-         return f"Exception Occurred, {e}"
+    except Exception:
+        logger.exception("Document summary failed; using the extracted chunks")
+        return None
 
 
 
@@ -88,6 +105,6 @@ if __name__ == "__main__":
         [0.05, 0.25, 0.6]
     ])
     
-    summary = extractive_summary(chunks, embeddings, num_summary_chunks=2)
+    summary = asyncio.run(extractive_summary(chunks, embeddings, num_summary_chunks=2))
     print("=== Extractive Summary ===")
     print(summary)
@@ -0,0 +1,162 @@
+import os
+import re
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from app.util.tokens import count_tokens, split_to_token_windows
+
+# Chunk size in model tokens, and how many trailing tokens of a chunk are repeated
+# at the start of the next one (same segment type only).
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "400"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+# A unit of chunking: (text, group, page, char_start, char_end). Offsets are into
+# the extracted text stream; page is None for sources without pages.
+Unit = Tuple[str, Optional[str], Optional[int], int, int]
+
+
+def iter_sentence_spans(text: str) -> Iterator[Tuple[str, int, int]]:
+    """``(sentence, start, end)`` for the sentences of ``text``, produced lazily."""
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        sentence = text[start:match.start()]
+        if sentence.strip():
+            lead = len(sentence) - len(sentence.lstrip())
+            yield sentence.strip(), start + lead, start + lead + len(sentence.strip())
+        start = match.end()
+    tail = text[start:]
+    if tail.strip():
+        lead = len(tail) - len(tail.lstrip())
+        yield tail.strip(), start + lead, start + lead + len(tail.strip())
+
+
+def iter_sentences(text: str) -> Iterator[str]:
+    """Sentences of ``text``, produced lazily."""
+    for sentence, _, _ in iter_sentence_spans(text):
+        yield sentence
+
+
+def _split_unit(unit: Unit, tokens: int, max_tokens: int) -> Iterator[Tuple[Unit, int]]:
+    text, group, page, start, _ = unit
+    if tokens <= max_tokens:
+        yield unit, tokens
+        return
+    pos = 0
+    for piece in split_to_token_windows(text, max_tokens):
+        found = text.find(piece, pos)
+        begin = found if found >= 0 else pos
+        pos = begin + len(piece)
+        piece = piece.strip()
+        if piece:
+            yield (piece, group, page, start + begin, start + pos), count_tokens(piece)
+
+
+def iter_chunk_records(units: Iterable[Unit], max_tokens: int = CHUNK_MAX_TOKENS,
+                       overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                       separator: str = " ") -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Group units into ``(chunk, metadata)`` of at most ``max_tokens`` tokens.
+
+    Each unit is tokenized once and the chunk size is kept as a running count,
+    so the work is linear in the input. A change of group always starts a new
+    chunk. Units longer than ``max_tokens`` are cut into token windows.
+    ``metadata`` has page_start, page_end, segment_type, char_start and char_end.
+    """
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+    current: deque = deque()  # (unit, tokens)
+    current_tokens = 0
+    current_group = None
+    fresh = 0  # units in ``current`` not yet emitted in a previous chunk
+
+    def flush(keep_overlap: bool):
+        nonlocal current_tokens, fresh
+        record = None
+        if fresh:
+            units_ = [unit for unit, _ in current]
+            pages = [unit[2] for unit in units_ if unit[2] is not None]
+            record = (separator.join(unit[0] for unit in units_), {
+                "page_start": min(pages) if pages else None,
+                "page_end": max(pages) if pages else None,
+                "segment_type": units_[0][1],
+                "char_start": units_[0][3],
+                "char_end": units_[-1][4],
+            })
+        carried: deque = deque()
+        kept = 0
+        if keep_overlap:
+            for unit, tokens in reversed(current):
+                if kept + tokens > overlap_tokens:
+                    break
+                carried.appendleft((unit, tokens))
+                kept += tokens
+        current.clear()
+        current.extend(carried)
+        current_tokens = kept
+        fresh = 0
+        return record
+
+    for unit in units:
+        if not unit[0].strip():
+            continue
+        unit = (unit[0].strip(),) + tuple(unit[1:])
+        group = unit[1]
+        if current_group is not None and group != current_group:
+            record = flush(keep_overlap=False)
+            if record:
+                yield record
+        current_group = group
+        for piece, piece_tokens in _split_unit(unit, count_tokens(unit[0]), max_tokens):
+            if fresh and current_tokens + piece_tokens > max_tokens:
+                record = flush(keep_overlap=True)
+                if record:
+                    yield record
+            # Overlap that no longer leaves room for the new unit is dropped.
+            while current and current_tokens + piece_tokens > max_tokens:
+                current_tokens -= current.popleft()[1]
+            current.append((piece, piece_tokens))
+            current_tokens += piece_tokens
+            fresh += 1
+    record = flush(keep_overlap=False)
+    if record:
+        yield record
+
+
+def iter_text_records(pieces: Iterable[str], max_tokens: int = CHUNK_MAX_TOKENS,
+                      overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Chunks of sentence-split text; ``pieces`` (paragraphs, pages...) may be any iterable.
+
+    Offsets count the pieces as if joined with newlines.
+    """
+    def units():
+        offset = 0
+        for piece in pieces:
+            for sentence, start, end in iter_sentence_spans(piece):
+                yield sentence, "text", None, offset + start, offset + end
+            offset += len(piece) + 1
+    return iter_chunk_records(units(), max_tokens, overlap_tokens)
+
+
+def iter_segment_records(segments: Iterable[Dict[str, Any]], max_tokens: int = CHUNK_MAX_TOKENS,
+                         overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Chunks of extracted PDF segments; page and type go to the metadata, not the text.
+
+    Offsets count the segment contents as if joined with newlines.
+    """
+    def units():
+        offset = 0
+        for seg in segments:
+            content = seg['content']
+            yield content, seg['type'], seg['page'], offset, offset + len(content)
+            offset += len(content) + 1
+    return iter_chunk_records(units(), max_tokens, overlap_tokens, separator="\n")
+
+
+def iter_text_chunks(pieces: Iterable[str], max_tokens: int = CHUNK_MAX_TOKENS,
+                     overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+    return (text for text, _ in iter_text_records(pieces, max_tokens, overlap_tokens))
+
+
+def iter_segment_chunks(segments: Iterable[Dict[str, Any]], max_tokens: int = CHUNK_MAX_TOKENS,
+                        overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+    return (text for text, _ in iter_segment_records(segments, max_tokens, overlap_tokens))
@@ -0,0 +1,77 @@
+import os
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from app.util.tokens import count_tokens, truncate_to_tokens
+
+# Token budget for retrieved context in the synthesis prompt.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Chunks whose embedding cosine similarity to an already packed chunk reaches this are
+# dropped. Above 1 near-duplicate dropping is off and searches skip fetching hit vectors.
+CONTEXT_DEDUPE_THRESHOLD = float(os.getenv("CONTEXT_DEDUPE_THRESHOLD", "0.95"))
+CONTEXT_DEDUPE_ENABLED = CONTEXT_DEDUPE_THRESHOLD <= 1.0
+# A chunk is only cut to fit the remaining budget if at least this many tokens are left.
+CONTEXT_MIN_TRUNCATED_TOKENS = int(os.getenv("CONTEXT_MIN_TRUNCATED_TOKENS", "64"))
+
+
+def _source_marker(n: int, hit: dict) -> str:
+    parts = [f"[{n}"]
+    if hit.get("document_id") is not None:
+        parts.append(f" doc {hit['document_id']}")
+    if hit.get("page_start") is not None:
+        pages = hit["page_start"], hit.get("page_end") or hit["page_start"]
+        parts.append(f" p.{pages[0]}" if pages[0] == pages[1] else f" p.{pages[0]}-{pages[1]}")
+    if hit.get("segment_type") and hit["segment_type"] != "text":
+        parts.append(f" {hit['segment_type']}")
+    if hit.get("chunk_index") is not None:
+        parts.append(f" #{hit['chunk_index']}")
+    return "".join(parts) + "]"
+
+
+def _unit(vector: Optional[Sequence[float]]) -> Optional[np.ndarray]:
+    if vector is None:
+        return None
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else None
+
+
+def pack_context(hits: List[dict], budget: int = CONTEXT_TOKEN_BUDGET,
+                 dedupe_threshold: float = CONTEXT_DEDUPE_THRESHOLD):
+    """Pack retrieved chunks, most relevant first, into at most ``budget`` tokens.
+
+    ``hits`` are vector store search results in relevance order. Exact repeats
+    and chunks too similar to one already packed are skipped; chunks that do
+    not fit are skipped so smaller, less relevant ones can still use the
+    budget. Returns ``(context, stats)``.
+    """
+    packed, kept_vectors, seen = [], [], set()
+    used = duplicates = over_budget = 0
+    for hit in hits:
+        text = (hit.get("chunk") or "").strip()
+        if not text or text in seen:
+            duplicates += bool(text)
+            continue
+        unit = _unit(hit.get("vector"))
+        if unit is not None and kept_vectors and float(np.max(np.stack(kept_vectors) @ unit)) >= dedupe_threshold:
+            duplicates += 1
+            continue
+        block = f"{_source_marker(len(packed) + 1, hit)} {text}"
+        cost = count_tokens(block) + 1  # separating newline
+        if used + cost > budget:
+            remaining = budget - used - 1
+            if packed or remaining < CONTEXT_MIN_TRUNCATED_TOKENS:
+                over_budget += 1
+                continue
+            # Never send an empty context because the best chunk alone is too long.
+            block = truncate_to_tokens(block, remaining)
+            cost = count_tokens(block) + 1
+        packed.append(block)
+        seen.add(text)
+        if unit is not None:
+            kept_vectors.append(unit)
+        used += cost
+    stats = {"chunks": len(packed), "tokens": used, "budget": budget,
+             "duplicates_dropped": duplicates, "over_budget_dropped": over_budget}
+    return "\n".join(packed), stats
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from app import db
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+# Cap on the in-process tier; entries are float32 arrays (6 KB each at 1536 dims).
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "86400"))
+EMBEDDING_CACHE_PERSIST = os.getenv("EMBEDDING_CACHE_PERSIST", "true").lower() in ("1", "true", "yes")
+# Minimum seconds between deletes of table rows older than EMBEDDING_CACHE_TTL, run from put_many.
+EMBEDDING_CACHE_PURGE_INTERVAL = float(os.getenv("EMBEDDING_CACHE_PURGE_INTERVAL", "300"))
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """In-process LRU with a per-entry TTL.
+
+    With ``max_bytes`` the cache also evicts until the summed ``nbytes`` of its
+    values (numpy arrays) fits the budget.
+    """
+
+    def __init__(self, max_size: int, ttl: float, max_bytes: Optional[int] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def _pop(self, key):
+        value, _ = self._data.pop(key)
+        self.nbytes -= getattr(value, "nbytes", 0)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            self._pop(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if key in self._data:
+            self._pop(key)
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self.nbytes += getattr(value, "nbytes", 0)
+        while self._data and (len(self._data) > self.max_size
+                              or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            self._pop(next(iter(self._data)))
+
+    def __len__(self):
+        return len(self._data)
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache: in-process LRU in front of the ``embedding_cache`` table.
+
+    The Postgres tier is shared by all workers and is skipped when the pool is
+    not open (scripts, benchmarks) or ``EMBEDDING_CACHE_PERSIST`` is off; its rows
+    expire after ``EMBEDDING_CACHE_TTL`` like memory entries. The memory tier holds
+    float32 arrays within ``EMBEDDING_CACHE_MAX_BYTES``. It caches query embeddings:
+    document chunk vectors already live in ``embeddings`` and are reused from there
+    by chunk hash, so they are not stored here a second time.
+    """
+
+    def __init__(self, model: str, max_size: int = EMBEDDING_CACHE_SIZE, ttl: float = EMBEDDING_CACHE_TTL,
+                 persist: bool = EMBEDDING_CACHE_PERSIST, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.model = model
+        self.memory = LRUCache(max_size, ttl, max_bytes=max_bytes)
+        self.persist = persist
+        self.counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "db_errors": 0, "purged": 0}
+        self._pending_writes = set()
+        self._last_purge = 0.0
+
+    def _db_enabled(self) -> bool:
+        return self.persist and db.pool_is_open()
+
+    async def get_many(self, texts: Sequence[str]) -> List[Optional[list]]:
+        keys = [cache_key(self.model, t) for t in texts]
+        results: List[Optional[list]] = [None] * len(keys)
+        for i, k in enumerate(keys):
+            cached = self.memory.get(k)
+            if cached is not None:
+                results[i] = cached.tolist()
+        self.counters["memory_hits"] += sum(r is not None for r in results)
+
+        missing = {k for k, r in zip(keys, results) if r is None}
+        if missing and self._db_enabled():
+            try:
+                async with db.get_connection() as conn:
+                    async with conn.cursor() as cur:
+                        await cur.execute(
+                            "SELECT text_hash, embedding::text FROM embedding_cache WHERE model = %s AND text_hash = ANY(%s)",
+                            (self.model, list(missing)),
+                        )
+                        found = {h: json.loads(v) for h, v in await cur.fetchall()}
+            except Exception as e:
+                self.counters["db_errors"] += 1
+                logger.warning("Embedding cache lookup failed: %s", e)
+                found = {}
+            for i, k in enumerate(keys):
+                if results[i] is None and k in found:
+                    results[i] = found[k]
+                    self.memory.put(k, np.asarray(found[k], dtype=np.float32))
+                    self.counters["db_hits"] += 1
+
+        self.counters["misses"] += sum(r is None for r in results)
+        return results
+
+    async def get(self, text: str) -> Optional[list]:
+        return (await self.get_many([text]))[0]
+
+    async def put_many(self, texts: Sequence[str], vectors: Sequence[list]):
+        rows = []
+        for text, vector in zip(texts, vectors):
+            key = cache_key(self.model, text)
+            self.memory.put(key, np.asarray(vector, dtype=np.float32))
+            rows.append((self.model, key, db.to_vector_literal(vector)))
+        if not rows or not self._db_enabled():
+            return
+        try:
+            async with db.get_connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.executemany(
+                        "INSERT INTO embedding_cache (model, text_hash, embedding) VALUES (%s, %s, %s::vector) "
+                        "ON CONFLICT (model, text_hash) DO NOTHING",
+                        rows,
+                    )
+                    if time.monotonic() - self._last_purge >= EMBEDDING_CACHE_PURGE_INTERVAL:
+                        self._last_purge = time.monotonic()
+                        await cur.execute(
+                            "DELETE FROM embedding_cache WHERE created_at <= CURRENT_TIMESTAMP - make_interval(secs => %s)",
+                            (self.memory.ttl,),
+                        )
+                        self.counters["purged"] += cur.rowcount
+        except Exception as e:
+            self.counters["db_errors"] += 1
+            logger.warning("Embedding cache write failed: %s", e)
+
+    def put_background(self, texts: Sequence[str], vectors: Sequence[list]):
+        """Store without making the caller wait for the Postgres write."""
+        task = asyncio.create_task(self.put_many(texts, vectors))
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+
+    def stats(self) -> dict:
+        lookups = self.counters["memory_hits"] + self.counters["db_hits"] + self.counters["misses"]
+        hits = lookups - self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.nbytes,
+        }
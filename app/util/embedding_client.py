@@ -1,9 +1,7 @@
-from app.util.openai_client import get_chat_content
-from app.util.openai_client import openai_client
-import asyncio
-from openai import OpenAI
-import httpx
+from app.util.openai_client import get_chat_content, shared_http_client, with_retries, record_usage
+from openai import AsyncOpenAI
 import os
+from app.util.embedding_cache import EmbeddingCache
 
 EMBEDDING_MODEL = "text-embedding-3-small"
 
@@ -14,30 +12,32 @@ load_dotenv()
 EMBEDDING_OPENAI_API_KEY = os.getenv("EMBEDDING_OPENAI_API_KEY","")
 EMBEDDING_OPENAI_API_BASE = os.getenv("EMBEDDING_OPENAI_API_BASE", "https://api.openai.com/v1")
 
-_http_client = httpx.Client(timeout=60.0)
-openai_client = OpenAI(api_key=EMBEDDING_OPENAI_API_KEY, base_url=EMBEDDING_OPENAI_API_BASE, http_client=_http_client)
+openai_client = AsyncOpenAI(api_key=EMBEDDING_OPENAI_API_KEY, base_url=EMBEDDING_OPENAI_API_BASE, http_client=shared_http_client, max_retries=0)
 
-async def get_embedding(text: str) -> list[float]:
-    loop = asyncio.get_event_loop()
-    def sync_embed():
-        response = openai_client.embeddings.create(
-            model=EMBEDDING_MODEL,  
-            input=[text]
-        )
-        return response.data[0].embedding
-    return await loop.run_in_executor(None, sync_embed)
+embedding_cache = EmbeddingCache(EMBEDDING_MODEL)
 
-def get_embeddings(texts: list[str]) -> list[list[float]]:
+async def get_embedding(text: str) -> list[float]:
+    cached = await embedding_cache.get(text)
+    if cached is not None:
+        return cached
+    vector = (await get_embeddings([text]))[0]
+    embedding_cache.put_background([text], [vector])
+    return vector
+
+async def get_embeddings(texts: list[str], max_retries: int = 3) -> list[list[float]]:
     if not isinstance(texts, list):
         raise ValueError("Input must be a list of strings.")
 
-    response = openai_client.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=texts
-    )
-    return [data.embedding for data in response.data]
+    async def call():
+        response = await openai_client.embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=texts
+        )
+        record_usage("embeddings", EMBEDDING_MODEL, response.usage)
+        return [data.embedding for data in response.data]
+    return await with_retries(call, max_retries, kind="embeddings")
 
-def get_message(query: str, context: str) -> list[dict]:
+async def get_message(query: str, context: str) -> list[dict]:
     system_prompt = (
         "You are a helpful assistant. Use the provided context to answer the user's question, response is to be understandable by a general audience and avoid technical jargon."
     )
@@ -45,6 +45,6 @@ def get_message(query: str, context: str) -> list[dict]:
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": f"User question: {query}\nContext: {context}"}
     ]
-    return get_chat_content(
+    return await get_chat_content(
         messages=message, model="gpt-4", max_retries=3, temperature=0.7, max_tokens=65355
     )
\ No newline at end of file
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, List, Optional, Sequence
+
+from app.util.embedding_client import get_embeddings
+from app.util.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "8000"))
+EMBEDDING_BATCH_MAX_ITEMS = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "256"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+
+
+def pack_batches(texts: Sequence[str], max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+                 max_items: int = EMBEDDING_BATCH_MAX_ITEMS) -> List[List[int]]:
+    """Group text indices into batches that stay under the token and item budgets.
+
+    A single text larger than ``max_tokens`` gets a batch of its own.
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for idx, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(idx)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def embed_chunks(chunks: Sequence[str], max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+                       concurrency: int = EMBEDDING_CONCURRENCY,
+                       on_progress: Optional[Callable[[int], None]] = None):
+    """Embed ``chunks`` in token-budgeted batches with at most ``concurrency`` requests in flight.
+
+    Returns ``(vectors, stats)`` where ``vectors[i]`` is the embedding of ``chunks[i]``.
+    ``on_progress`` is called with the number of chunks that have a vector so far.
+
+    Chunk vectors are not put in the embedding cache: they are stored in
+    ``embeddings`` and reused from there by chunk hash when a document is revised.
+    """
+    start = time.perf_counter()
+    vectors: List[Optional[list]] = [None] * len(chunks)
+
+    # Embed each distinct text once; duplicates share the result.
+    pending = {}
+    for idx, chunk in enumerate(chunks):
+        pending.setdefault(chunk, []).append(idx)
+    texts = list(pending)
+    done = 0
+    if on_progress:
+        on_progress(done)
+    batches = pack_batches(texts, max_tokens=max_tokens)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_batch(indices: List[int]):
+        nonlocal done
+        batch_texts = [texts[i] for i in indices]
+        async with semaphore:
+            result = await get_embeddings(batch_texts)
+        for text, vector in zip(batch_texts, result):
+            for i in pending[text]:
+                vectors[i] = vector
+            done += len(pending[text])
+        if on_progress:
+            on_progress(done)
+
+    await asyncio.gather(*[run_batch(indices) for indices in batches])
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        "chunks": len(chunks),
+        "embedded": len(texts),
+        "duplicates": len(chunks) - len(texts),
+        "batches": len(batches),
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(len(chunks) / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    logger.info("Embedded %(chunks)d chunks in %(batches)d batches (%(chunks_per_sec)s chunks/s)", stats)
+    return vectors, stats
@@ -1,5 +1,8 @@
 import re
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 def extract_sequence_from_llm_response(response: str) -> list:
     cleaned = '\n'.join(line for line in response.splitlines() if '```' not in line)
@@ -8,7 +11,7 @@ def extract_sequence_from_llm_response(response: str) -> list:
         if isinstance(parsed, list):   
             return parsed
     except Exception as e:
-        print(f"JSON parsing error: {e}")
+        logger.debug("JSON parsing error: %s", e)
         try:
             fixed = cleaned.replace("'", '"')
             parsed = json.loads(fixed)
@@ -25,5 +28,5 @@ def extract_sequence_from_llm_response(response: str) -> list:
                 return parsed
         except json.JSONDecodeError:
             return []
-    print("Failed to extract sequence from LLM response.")    
+    logger.warning("Failed to extract sequence from LLM response.")
     return []
\ No newline at end of file
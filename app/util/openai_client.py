@@ -1,37 +1,142 @@
 import os
+import asyncio
+import random
+import logging
 import httpx
-from openai import OpenAI
-from typing import Optional
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError
+from typing import Optional, AsyncIterator, Awaitable, Callable, TypeVar
 import base64
+import time
 from dotenv import load_dotenv
+from app.util.metrics import OPENAI_REQUEST_SECONDS, OPENAI_RETRIES, OPENAI_TOKENS, record_timing
+from app.util.tokens import count_tokens
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY","")
 OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
 
-_http_client = httpx.Client(timeout=60.0)
-openai_client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_API_BASE, http_client=_http_client)
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "20"))
+
+# One pooled transport shared by every OpenAI-compatible client in the process
+# (chat, vision and embeddings), so connections are kept alive and reused.
+shared_http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=10.0),
+    limits=httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    ),
+)
+# Retries are handled by with_retries below, not by the SDK.
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_API_BASE, http_client=shared_http_client, max_retries=0)
+
+T = TypeVar("T")
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
 
-def get_chat_content(messages: list[dict], model: str = "gpt-4", max_retries: int = 3, temperature: float = 0.7, max_tokens: int = 65355) -> str:
+def _observe_attempt(kind: str, outcome: str, start: float):
+    elapsed = time.perf_counter() - start
+    OPENAI_REQUEST_SECONDS.observe(elapsed, kind=kind, outcome=outcome)
+    record_timing(f"openai.{kind}", elapsed)
+
+
+def record_usage(kind: str, model: str, usage=None, prompt_tokens: int = 0, completion_tokens: int = 0):
+    """Count prompt/completion tokens from a response ``usage`` (or the given estimates)."""
+    if usage is not None:
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    if prompt_tokens:
+        OPENAI_TOKENS.inc(prompt_tokens, kind=kind, model=model, type="prompt")
+    if completion_tokens:
+        OPENAI_TOKENS.inc(completion_tokens, kind=kind, model=model, type="completion")
+
+
+async def with_retries(call: Callable[[], Awaitable[T]], max_retries: int = 3, kind: str = "openai") -> T:
+    """Await ``call()``, retrying rate limits, 5xx and connection errors with
+    exponential backoff and full jitter. Each attempt is timed under ``kind``."""
     for attempt in range(max_retries):
+        start = time.perf_counter()
         try:
-            response = openai_client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
-            return response.choices[0].message.content
+            result = await call()
+            _observe_attempt(kind, "ok", start)
+            return result
         except Exception as e:
-            print(f"Attempt {attempt + 1} failed: {e}")
-            if attempt == max_retries - 1:
+            _observe_attempt(kind, "error", start)
+            if attempt == max_retries - 1 or not _is_retryable(e):
                 raise
-    raise RuntimeError("Failed to get chat content after retries.")
+            OPENAI_RETRIES.inc(kind=kind)
+            delay = random.uniform(0, min(OPENAI_RETRY_MAX_DELAY, OPENAI_RETRY_BASE_DELAY * 2 ** attempt))
+            logger.warning("Attempt %d failed (%s); retrying in %.2fs", attempt + 1, e, delay)
+            await asyncio.sleep(delay)
+    raise RuntimeError("Failed to get response after retries.")
+
 
-    #return response.choices[0].message.content.strip()
+async def aclose_clients():
+    await shared_http_client.aclose()
 
-def get_image_caption(image_bytes: bytes, prompt: Optional[str]= None, model: str = "sonar", max_retries: int=3) -> str:
+
+async def get_chat_content(messages: list[dict], model: str = "gpt-4", max_retries: int = 3, temperature: float = 0.7, max_tokens: int = 65355) -> str:
+    async def call():
+        response = await openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        record_usage("chat", model, response.usage)
+        return response.choices[0].message.content
+    return await with_retries(call, max_retries, kind="chat")
+
+async def stream_chat_content(messages: list[dict], model: str = "gpt-4", max_retries: int = 3, temperature: float = 0.7, max_tokens: int = 65355) -> AsyncIterator[str]:
+    """Yield completion text deltas as they arrive.
+
+    Only opening the stream is retried; an error after the first delta propagates.
+    The time to the first delta and the whole stream are recorded separately.
+    """
+    start = time.perf_counter()
+    stream = await with_retries(
+        lambda: openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        ),
+        max_retries,
+        kind="chat_stream",
+    )
+    parts, usage = [], None
+    async for chunk in stream:
+        usage = getattr(chunk, "usage", None) or usage
+        if chunk.choices and chunk.choices[0].delta.content:
+            if not parts:
+                OPENAI_REQUEST_SECONDS.observe(time.perf_counter() - start, kind="chat_stream_first_token", outcome="ok")
+            parts.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+    elapsed = time.perf_counter() - start
+    OPENAI_REQUEST_SECONDS.observe(elapsed, kind="chat_stream_total", outcome="ok")
+    if usage is not None:
+        record_usage("chat_stream", model, usage)
+    else:  # providers that do not report usage on streams
+        record_usage("chat_stream", model, prompt_tokens=sum(count_tokens(str(m.get("content", ""))) for m in messages),
+                     completion_tokens=count_tokens("".join(parts)))
+
+async def get_image_caption(image_bytes: bytes, prompt: Optional[str]= None, model: str = "sonar", max_retries: int=3) -> str:
     if prompt is None:
         prompt = (
             """
@@ -58,7 +163,7 @@ def get_image_caption(image_bytes: bytes, prompt: Optional[str]= None, model: st
         """            
         )
     
-    b64 = base64.b64encode(image_bytes).decode("utf-8");
+    b64 = base64.b64encode(image_bytes).decode("utf-8")
     messages = [
         {
             "role": "user",
@@ -68,18 +173,15 @@ def get_image_caption(image_bytes: bytes, prompt: Optional[str]= None, model: st
             ]
         }
     ]
-    last_err = None
-    for attempt in range(max_retries):
-        try:
-            resp = openai_client.chat.completions.create(
-                model = model,
-                messages = messages,
-                temperature = 0.0                
-            )
-            return (resp.choices[0].message.content or "").strip()
-            #return "sample";
-        except Exception as e:
-            last_err = e
-    raise RuntimeError(f"Vision caption failed after retries: {last_err}")
-
-
+    async def call():
+        resp = await openai_client.chat.completions.create(
+            model = model,
+            messages = messages,
+            temperature = 0.0                
+        )
+        record_usage("vision", model, resp.usage)
+        return (resp.choices[0].message.content or "").strip()
+    try:
+        return await with_retries(call, max_retries, kind="vision")
+    except Exception as e:
+        raise RuntimeError(f"Vision caption failed after retries: {e}") from e
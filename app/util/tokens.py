@@ -0,0 +1,54 @@
+import os
+
+try:
+    import tiktoken
+except ImportError:  # fall back to a character heuristic when tiktoken is unavailable
+    tiktoken = None
+
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception:
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    """Number of model tokens in ``text`` (approximate when tiktoken is missing)."""
+    if not text:
+        return 0
+    enc = _get_encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of ``text`` that fits in ``max_tokens`` tokens."""
+    if max_tokens <= 0 or not text:
+        return ""
+    enc = _get_encoding()
+    if enc is not None:
+        tokens = enc.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else enc.decode(tokens[:max_tokens])
+    return text[:(max_tokens - 1) * 4]
+
+
+def split_to_token_windows(text: str, max_tokens: int):
+    """Yield consecutive pieces of ``text`` of at most ``max_tokens`` tokens each."""
+    enc = _get_encoding()
+    if enc is not None:
+        tokens = enc.encode(text, disallowed_special=())
+        for start in range(0, len(tokens), max_tokens):
+            yield enc.decode(tokens[start:start + max_tokens])
+        return
+    step = max(1, (max_tokens - 1) * 4)
+    for start in range(0, len(text), step):
+        yield text[start:start + step]
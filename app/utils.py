@@ -1,22 +1,42 @@
 from docx import Document
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Callable
 import re
 from pypdf import PdfReader
 import pdfplumber
-import io
-from pdf2image import convert_from_path
-import pytesseract
-from PIL import Image
 from app.util.openai_client import get_image_caption
+from app.util.chunker import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, iter_segment_chunks, iter_text_chunks
+from app.util.caption_cache import caption_cache, content_hash, perceptual_hash, hamming, CAPTION_CACHE_PHASH, CAPTION_PHASH_MAX_DISTANCE
 import fitz
+import logging
 import os
+import asyncio
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 
 page_out_dir = os.path.join(os.getcwd(), "data", "image_crops")
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "200"))
+CAPTION_CONCURRENCY = int(os.getenv("CAPTION_CONCURRENCY", "4"))
+CAPTION_TIMEOUT = float(os.getenv("CAPTION_TIMEOUT", "120"))
+# Rendered crops wait for captioning as files here (default: the system temp dir), not in memory.
+PDF_CROP_SPOOL_DIR = os.getenv("PDF_CROP_SPOOL_DIR") or None
+# Parallel page extraction: default workers per document, pages per task and
+# the size of the process pool shared by all uploads.
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "1"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+PDF_EXTRACT_POOL_SIZE = int(os.getenv("PDF_EXTRACT_POOL_SIZE", str(os.cpu_count() or 1)))
 
-def extract_text_from_docx(file_path: str) -> str:
+_process_pool = None
+
+logger = logging.getLogger(__name__)
+
+def iter_docx_text(file_path: str) -> Iterator[str]:
+    """Paragraphs, then table cells, of a .docx file."""
     doc = Document(file_path)
-    texts = [para.text for para in doc.paragraphs if para.text.strip()]
+    for para in doc.paragraphs:
+        if para.text.strip():
+            yield para.text
 
     for table in doc.tables:
         headers = [cell.text for cell in table.rows[0].cells]
@@ -28,9 +48,23 @@ def extract_text_from_docx(file_path: str) -> str:
                 header = headers[col_idx] if col_idx < len(headers) else f"Column {col_idx+1}"
                 value = cell.text.strip()
                 if value:
-                    cell_text = f"Table: {header} | Row: {first_col}: | Value: {value}"
-                    texts.append(cell_text)
-    return '\n'.join(texts)
+                    yield f"Table: {header} | Row: {first_col}: | Value: {value}"
+
+def extract_text_from_docx(file_path: str) -> str:
+    return '\n'.join(iter_docx_text(file_path))
+
+def iter_text_file(file_path: str) -> Iterator[str]:
+    """Blank-line separated paragraphs of a text file, read incrementally."""
+    paragraph: List[str] = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                paragraph.append(line.strip())
+            elif paragraph:
+                yield ' '.join(paragraph)
+                paragraph = []
+    if paragraph:
+        yield ' '.join(paragraph)
 
 def extract_text_from_pdf(file_path: str) -> str:
     """
@@ -49,13 +83,66 @@ def extract_text_from_pdf(file_path: str) -> str:
             pages_text.append(txt)
     return "\n\n".join(pages_text)
 
-def extract_rich_pdf_segments(file_path: str, text_extract_only: bool = False) -> List[Dict[str, Any]]:
+def region_clip_rect(region: Dict[str, Any], pg_w: float, pg_h: float):
+    """Clip rectangle (PDF points, top-left origin) for an image region, or None if empty."""
+    x0, y0, x1, y1 = (float(region[k]) for k in ('x0', 'y0', 'x1', 'y1'))
+    if region.get('origin', 'bottom-left') == 'bottom-left':
+        y0, y1 = pg_h - y1, pg_h - y0
+    rect = fitz.Rect(x0, y0, x1, y1) & fitz.Rect(0, 0, pg_w, pg_h)
+    if rect.is_empty:
+        return None
+    return rect
+
+
+def render_region_png(fitz_page, region: Dict[str, Any], pg_w: float, pg_h: float, dpi: int = PDF_RENDER_DPI):
+    """Rasterize only ``region`` of an open PyMuPDF page and return PNG bytes.
+
+    Avoids re-rendering the whole page (and a pdftoppm process per page).
+    """
+    if fitz_page is None or any(region.get(k) is None for k in ('x0', 'y0', 'x1', 'y1')):
+        return None
+    rect = region_clip_rect(region, pg_w, pg_h)
+    if rect is None:
+        return None
+    # Regions are expressed in pdfplumber page units; map them onto the fitz page box.
+    page_rect = fitz_page.rect
+    sx, sy = page_rect.width / pg_w, page_rect.height / pg_h
+    clip = fitz.Rect(page_rect.x0 + rect.x0 * sx, page_rect.y0 + rect.y0 * sy,
+                     page_rect.x0 + rect.x1 * sx, page_rect.y0 + rect.y1 * sy)
+    pix = fitz_page.get_pixmap(dpi=dpi, clip=clip)
+    if pix.width == 0 or pix.height == 0:
+        return None
+    return pix.tobytes("png")
+
+
+def _report_pages(page_indices, on_page: Optional[Callable[[int], None]]):
+    """Yield ``page_indices``, calling ``on_page(pages_done)`` after each page has been processed."""
+    for done, page_index in enumerate(page_indices, start=1):
+        yield page_index
+        if on_page:
+            on_page(done)
+
+
+def extract_pdf_pages(file_path: str, start_page: int = 0, end_page: int = None,
+                      text_extract_only: bool = False, dpi: int = PDF_RENDER_DPI,
+                      crop_dir: Optional[str] = None,
+                      on_page: Optional[Callable[[int], None]] = None) -> List[Dict[str, Any]]:
+    """Extract text, table-row and image segments for pages ``[start_page, end_page)``.
+
+    Image segments that rendered successfully are captioned afterwards (see
+    ``caption_image_segments``). With ``crop_dir`` the PNG is written there, named
+    by its content hash, and the segment keeps only ``'png_path'`` and ``'png_hash'``;
+    otherwise it carries the bytes under ``'png'``. ``on_page(pages_done)`` is
+    called after each page, from the thread doing the extraction.
+    """
     segments: List[Dict[str, Any]]= []    
     fitz_doc = fitz.open(file_path)
-    img_idx = 0
     try:
         with pdfplumber.open(file_path) as pdf:
-            for page_index, page in enumerate(pdf.pages):                
+            if end_page is None:
+                end_page = len(pdf.pages)
+            for page_index in _report_pages(range(start_page, end_page), on_page):
+                page = pdf.pages[page_index]
                 page_num = page_index + 1
                 try:            
                     text = page.extract_text() or ""                    
@@ -100,17 +187,17 @@ def extract_rich_pdf_segments(file_path: str, text_extract_only: bool = False) -
                 #    })
                 
                 
+                fitz_page = None
                 try:
                     if fitz_doc is not None:
                         fitz_page = fitz_doc[page_index]
                     else:
-                        fitx_page = None
+                        fitz_page = None
                     if fitz_page is not None:
                         raw = fitz_page.get_text("rawdict") or {}
                         for blk in raw.get('blocks', []):
                             if blk.get('type') == 1:                                
                                 bbox = blk.get('bbox') or []
-                                print(len(bbox))
                                 if len(bbox) == 4:
                                     x0, y0, x1, y1 = bbox
                                     image_regions.append({
@@ -136,109 +223,219 @@ def extract_rich_pdf_segments(file_path: str, text_extract_only: bool = False) -
                     pass
                 
                 if image_regions:
-                    try:
-                        page_img = convert_from_path(file_path, first_page=page_num, last_page=page_num, dpi=200)[0]
-                    except Exception as e:
-                        import traceback
-                        traceback.print_exc()
-                        print(e)
-                        page_img = None
+                    pg_w, pg_h = float(page.width), float(page.height)
                     for region in image_regions:
                         x0 = region['x0']; y0= region['y0']; x1 = region['x1']; y1= region['y1']; 
                         name = region.get('name', 'image')
-                        origin = region.get('origin', 'bottom-left')                    
-                        if page_img and all(v is not None for v in [x0,y0,x1,y1]):
-                            #print("i am inside")
-                            try:
-                                pg_w, pg_h = float(page.width), float(page.height)
-                                
-                                fx0 = max(0.0, min(1.0, float(x0)/pg_w))
-                                fy0 = max(0.0, min(1.0, float(y0)/pg_h))
-                                fx1 = max(0.0, min(1.0, float(x1)/pg_w))
-                                fy1 = max(0.0, min(1.0, float(y1)/pg_h))
-                                
-                                img_w, img_h = page_img.size
-                                if origin == 'bottom-left':
-                                    top = int((1.0-fy1) * img_h)
-                                    bottom = int((1.0-fy0) * img_h)
-                                else:
-                                    top = int(fy0 * img_h)
-                                    bottom = int(fy1 * img_h)
-                                left = int(fx0 * img_w)
-                                right = int(fx1 * img_w)
-                                left, right = max(0, min(left, img_w)), max(0, min(right, img_w))
-                                top, bottom = max(0, min(top, img_h)), max(0, min(bottom, img_h))
-                                #print(f'right - {right}, left - {left}, bottom -{bottom}, top-{top}')
-                                if right > left and bottom > top:                                                                
-                                    crop = page_img.crop((left, top, right, bottom))
-                                    img_idx += 1
-                                    fname = f"img_{page_num:04d}_{img_idx:03d}.png"
-                                    out_path = os.path.join(page_out_dir, fname)
-                                    buf = io.BytesIO()                                   
-                                    #crop.save(out_path, format='PNG')
-                                    crop.save(buf, format='PNG')
-                                    caption = get_image_caption(buf.getvalue())
-                                    print(caption)
-                                    content = f"name={name}, caption={caption}"
-                                    segments.append({'type':'image', 'page':page_num, 'content': content})
+                        meta = f"name={name}, bbox=({x0},{y0},{x1},{y1})"
+                        segment = {'type':'image', 'page':page_num, 'content': meta}
+                        try:
+                            png = render_region_png(fitz_page, region, pg_w, pg_h, dpi=dpi)
+                            if png:
+                                # Captioned later, concurrently; 'content' keeps the bbox fallback.
+                                segment['name'] = name
+                                if crop_dir:
+                                    segment['png_hash'] = content_hash(png)
+                                    segment['png_path'] = os.path.join(crop_dir, segment['png_hash'] + '.png')
+                                    if not os.path.exists(segment['png_path']):
+                                        with open(segment['png_path'], 'wb') as f:
+                                            f.write(png)
                                 else:
-                                    meta = f"name={name}, bbox=({x0},{y0},{x1},{y1})"
-                                    segments.append({'type':'image', 'page':page_num, 'content': meta})
-                            except Exception as e:
-                                import traceback
-                                traceback.print_exc()
-                                meta = f"name={name}, bbox=({x0},{y0},{x1},{y1})"
-                                segments.append({'type':'image', 'page':page_num, 'content': meta})
-                        else:
-                            meta = f"name={name}, bbox=({x0},{y0},{x1},{y1})"
-                            segments.append({'type':'image', 'page':page_num, 'content': meta})
-    except Exception as e:        
-        import traceback
-        traceback.print_exc()
-        fallback = extract_text_from_pdf(file_path)
-        if fallback.strip():
-            segments.append({'type': 'text', 'page': 1, 'content': fallback.strip()})
+                                    segment['png'] = png
+                        except Exception:
+                            logger.exception("Could not render %s on page %s", name, page_num)
+                        segments.append(segment)
+    finally:
+        fitz_doc.close()
     return segments
 
-def chunk_segments(segments: List[Dict[str, Any]], max_words: int = 300) -> List[str]:
-    chunks: List[str] = []
-    current_words = 0
-    current_parts: List[str] = []
-    current_mode: str | None = None
 
-    def flush():
-        nonlocal current_parts, current_words, current_mode
-        if current_parts:
-            chunks.append('\n'.join(current_parts).strip())
-        current_parts = []
-        current_words = 0
-        current_mode = None
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # spawn, not fork: the parent has an event loop and client threads running.
+        _process_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_POOL_SIZE,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
 
-    for seg in segments:
-        seg_words = len(seg['content'].split())
-        mode = seg['type']
-        prefix = f"[PAGE {seg['page']} | {mode.upper()}]"
-        line = prefix + seg['content']
-        if current_mode is not None and mode !=current_mode:
-            flush()
-        if current_words + seg_words > max_words and current_parts:
-            flush()
-        current_parts.append(line)
-        current_words += seg_words
-        current_mode = mode
-    flush()
-    return chunks
-
-def chunk_text(text: str, max_chunk_size: int = 1000) -> List[str]:
-    sentences = re.split(r'(?<=[.!?]) +', text)
-    chunks = []
-    current = ""
-    for sent in sentences:
-        if len((current+sent).split()) > max_chunk_size:
-            chunks.append(current.strip())
-            current = sent + " "
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+
+
+def page_ranges(num_pages: int, workers: int, pages_per_task: int = PDF_PAGES_PER_TASK) -> List[tuple]:
+    size = max(1, min(pages_per_task, -(-num_pages // max(1, workers))))
+    return [(start, min(start + size, num_pages)) for start in range(0, num_pages, size)]
+
+
+async def extract_pdf_pages_parallel(file_path: str, text_extract_only: bool = False,
+                                     workers: int = PDF_EXTRACT_WORKERS,
+                                     on_progress: Optional[Callable[[int, int], None]] = None,
+                                     crop_dir: Optional[str] = None) -> List[Dict[str, Any]]:
+    """``extract_pdf_pages`` over the whole file, fanned out to the process pool by page range.
+
+    At most ``workers`` ranges of this document run at once; segments are merged
+    back in page order, so the output matches the serial path. ``on_progress``
+    is called with ``(pages_done, pages_total)`` after every page on the serial
+    path and as ranges finish on the parallel one.
+    """
+    with fitz.open(file_path) as doc:
+        num_pages = doc.page_count
+    ranges = page_ranges(num_pages, workers)
+    loop = asyncio.get_running_loop()
+    if workers <= 1 or len(ranges) <= 1:
+        on_page = (lambda done: loop.call_soon_threadsafe(on_progress, done, num_pages)) if on_progress else None
+        return await asyncio.to_thread(extract_pdf_pages, file_path, 0, None, text_extract_only,
+                                       PDF_RENDER_DPI, crop_dir, on_page)
+
+    pool = get_process_pool()
+    semaphore = asyncio.Semaphore(workers)
+    pages_done = 0
+
+    async def run(start, end):
+        nonlocal pages_done
+        async with semaphore:
+            part = await loop.run_in_executor(pool, extract_pdf_pages, file_path, start, end, text_extract_only,
+                                              PDF_RENDER_DPI, crop_dir)
+        pages_done += end - start
+        if on_progress:
+            on_progress(pages_done, num_pages)
+        return part
+
+    parts = await asyncio.gather(*[run(start, end) for start, end in ranges])
+    return [seg for part in parts for seg in part]
+
+
+def _has_image(segment: Dict[str, Any]) -> bool:
+    return 'png' in segment or 'png_path' in segment
+
+
+def _load_png(segment: Dict[str, Any]) -> bytes:
+    if 'png' in segment:
+        return segment['png']
+    with open(segment['png_path'], 'rb') as f:
+        return f.read()
+
+
+def _segment_phash(segment: Dict[str, Any]) -> int:
+    return perceptual_hash(_load_png(segment))
+
+
+async def caption_image_segments(segments: List[Dict[str, Any]], concurrency: int = CAPTION_CONCURRENCY,
+                                 timeout: float = CAPTION_TIMEOUT, use_phash: bool = CAPTION_CACHE_PHASH,
+                                 on_progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+    """Caption every image segment (``'png'`` bytes or a spooled ``'png_path'``) in place,
+    at most ``concurrency`` at a time. Spooled crops are only read back while being captioned.
+
+    Repeats of the same crop within the document (by content hash, or by
+    perceptual hash when ``use_phash``) are dropped from ``segments``, and
+    captions already in the caption cache are reused. A caption that fails or
+    exceeds ``timeout`` seconds leaves the bbox description. Returns hit-rate stats;
+    ``on_progress`` gets ``(images_done, images_total)``, starting with ``(0, total)``
+    before any hashing or captioning; duplicates and cache hits count as done.
+    """
+    pending = [seg for seg in segments if _has_image(seg)]
+    if on_progress:
+        on_progress(0, len(pending))
+    keys: Dict[int, str] = {}
+    phashes: Dict[str, int] = {}
+    first_by_key: Dict[str, Dict[str, Any]] = {}
+    duplicates = set()
+    for seg in pending:
+        key = seg.get('png_hash') or content_hash(seg['png'])
+        if use_phash and key not in first_by_key:
+            try:
+                # Decoding a full-page crop is CPU-heavy; keep it off the event loop.
+                phash = await asyncio.to_thread(_segment_phash, seg)
+                # Match representatives only, so captions are never stored under a dropped crop's hash.
+                near = next((k for k in first_by_key
+                             if k in phashes and hamming(phashes[k], phash) <= CAPTION_PHASH_MAX_DISTANCE), None)
+                if near is not None:
+                    key = near
+                else:
+                    phashes[key] = phash
+            except Exception:
+                pass
+        keys[id(seg)] = key
+        if key in first_by_key:
+            duplicates.add(id(seg))
         else:
-            current += sent + " "
-    if current.split():
-        chunks.append(current.strip())
-    return chunks
+            first_by_key[key] = seg
+    if duplicates:
+        segments[:] = [seg for seg in segments if id(seg) not in duplicates]
+
+    cached = await caption_cache.get_many(list(first_by_key), phashes if use_phash else None)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    new_captions: Dict[str, str] = {}
+
+    to_caption = [(key, seg) for key, seg in first_by_key.items() if key not in cached]
+    done = len(pending) - len(to_caption)
+    if on_progress and done:
+        on_progress(done, len(pending))
+
+    async def caption(key, segment):
+        nonlocal done
+        name = segment.get('name', 'image')
+        async with semaphore:
+            try:
+                png = await asyncio.to_thread(_load_png, segment)
+                new_captions[key] = await asyncio.wait_for(get_image_caption(png), timeout=timeout)
+            except Exception as e:
+                logger.warning("Caption failed for %s on page %s: %r", name, segment['page'], e)
+        done += 1
+        if on_progress:
+            on_progress(done, len(pending))
+
+    await asyncio.gather(*[caption(key, seg) for key, seg in to_caption])
+    await caption_cache.put_many(new_captions, phashes)
+
+    captions = {**cached, **new_captions}
+    for seg in segments:
+        if _has_image(seg):
+            key = keys[id(seg)]
+            name = seg.pop('name', 'image')
+            for field in ('png', 'png_path', 'png_hash'):
+                seg.pop(field, None)
+            if key in captions:
+                seg['content'] = f"name={name}, caption={captions[key]}"
+
+    return {
+        "images": len(pending),
+        "duplicates_dropped": len(duplicates),
+        "unique_images": len(first_by_key),
+        "cache_hits": len(cached),
+        "captioned": len(new_captions),
+        "cache_hit_rate": round(len(cached) / len(first_by_key), 4) if first_by_key else 0.0,
+    }
+
+
+async def extract_rich_pdf_segments(file_path: str, text_extract_only: bool = False,
+                                    stats: Optional[Dict[str, Any]] = None,
+                                    workers: Optional[int] = None,
+                                    on_pages: Optional[Callable[[int, int], None]] = None,
+                                    on_captions: Optional[Callable[[int, int], None]] = None) -> List[Dict[str, Any]]:
+    # Crops are spooled to disk until captioned, then removed with the directory.
+    with tempfile.TemporaryDirectory(prefix="pdf-crops-", dir=PDF_CROP_SPOOL_DIR) as crop_dir:
+        try:
+            segments = await extract_pdf_pages_parallel(file_path, text_extract_only, workers or PDF_EXTRACT_WORKERS,
+                                                        on_progress=on_pages, crop_dir=crop_dir)
+        except Exception:
+            logger.exception("Rich PDF extraction failed for %s; falling back to plain text", file_path)
+            segments = []
+            fallback = await asyncio.to_thread(extract_text_from_pdf, file_path)
+            if fallback.strip():
+                segments.append({'type': 'text', 'page': 1, 'content': fallback.strip()})
+        caption_stats = await caption_image_segments(segments, on_progress=on_captions)
+    if stats is not None:
+        stats["captions"] = caption_stats
+    return segments
+
+def chunk_segments(segments: List[Dict[str, Any]], max_tokens: int = CHUNK_MAX_TOKENS,
+                   overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    return list(iter_segment_chunks(segments, max_tokens, overlap_tokens))
+
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    return list(iter_text_chunks([text], max_tokens, overlap_tokens))
@@ -0,0 +1,27 @@
+import os
+from typing import Optional
+
+from .base import ChunkPlan, VectorStore, plan_chunk_reuse
+
+# Where chunk vectors are stored and searched: "pgvector" (default) or "local".
+# Either way the app needs Postgres with pgvector for documents and caches.
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pgvector")
+
+_store: Optional[VectorStore] = None
+
+
+def get_vector_store() -> VectorStore:
+    global _store
+    if _store is None:
+        if VECTOR_STORE == "local":
+            from .local_store import LocalVectorStore
+            _store = LocalVectorStore()
+        elif VECTOR_STORE == "pgvector":
+            from .pgvector_store import PgVectorStore
+            _store = PgVectorStore()
+        else:
+            raise ValueError(f"Unsupported VECTOR_STORE: {VECTOR_STORE}")
+    return _store
+
+
+__all__ = ["ChunkPlan", "VectorStore", "get_vector_store", "plan_chunk_reuse"]
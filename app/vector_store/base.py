@@ -0,0 +1,59 @@
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+
+class ChunkPlan(NamedTuple):
+    """How a new version of a document's chunks maps onto what is already stored."""
+    vectors: List[Optional[list]]        # reused vector per chunk, None where it must be embedded
+    retained: List[Tuple[Any, int]]      # (stored chunk ref, new chunk_index)
+    new_indices: List[int]               # chunk indices to embed and insert
+    stale_refs: List[Any]                # stored chunks that are no longer present
+
+
+def plan_chunk_reuse(hashes: Sequence[str], existing: Dict[str, List[Tuple[Any, list]]]) -> ChunkPlan:
+    """Match new chunk hashes against ``existing`` (``{hash: [(ref, vector), ...]}``), as a multiset."""
+    existing = {h: list(rows) for h, rows in existing.items()}
+    vectors: List[Optional[list]] = [None] * len(hashes)
+    retained = []
+    for idx, hash_ in enumerate(hashes):
+        if existing.get(hash_):
+            ref, vector = existing[hash_].pop(0)
+            retained.append((ref, idx))
+            vectors[idx] = vector
+    new_indices = [idx for idx, vector in enumerate(vectors) if vector is None]
+    stale_refs = [ref for rows in existing.values() for ref, _ in rows]
+    return ChunkPlan(vectors, retained, new_indices, stale_refs)
+
+
+class VectorStore(ABC):
+    """Storage and top-k search of chunk embeddings, behind doc_search and ingestion.
+
+    Search hits are dicts with ``chunk``, ``score`` (higher is better),
+    ``document_id``, ``chunk_index``, ``page_start``, ``page_end`` and
+    ``segment_type``, plus ``vector`` (float32 array) when searched with
+    ``with_vectors=True``.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    async def existing_chunks(self, document_id: int, conn=None) -> Dict[str, List[Tuple[Any, list]]]:
+        """Stored chunks of ``document_id`` as ``{chunk_hash: [(ref, vector), ...]}``.
+        ``conn`` lets SQL backends read inside the caller's transaction."""
+
+    @abstractmethod
+    async def write_chunks(self, document_id: int, chunks: Sequence[str], vectors: Sequence[list],
+                           hashes: Sequence[str], plan: ChunkPlan, conn=None,
+                           on_progress: Optional[Callable[[int], None]] = None,
+                           metadata: Optional[Sequence[dict]] = None) -> dict:
+        """Make the stored chunks of ``document_id`` equal to ``chunks``, using ``plan``
+        to avoid rewriting unchanged ones. ``metadata`` is the per-chunk provenance
+        (page_start, page_end, segment_type, char_start, char_end). ``conn`` lets SQL
+        backends join the caller's transaction. Returns write stats."""
+
+    @abstractmethod
+    async def search(self, query_vector: list, top_k: int, document_id: Optional[int] = None,
+                     query_text: Optional[str] = None, **options) -> List[dict]:
+        """Top ``top_k`` chunks for ``query_vector``; ``options`` carries backend tuning
+        (search_mode, retrieval_mode, ef_search, ...) and metadata filters
+        (segment_types, page_from, page_to). Unsupported tuning options are ignored."""
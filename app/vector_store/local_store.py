@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .base import ChunkPlan, VectorStore
+
+logger = logging.getLogger(__name__)
+
+LOCAL_VECTOR_STORE_DIR = os.getenv("LOCAL_VECTOR_STORE_DIR", os.path.join(os.getcwd(), "data", "vector_store"))
+LOCAL_VECTOR_DTYPE = os.getenv("LOCAL_VECTOR_DTYPE", "float16")  # "float16" or "int8"
+# Candidates re-scored in float32 per requested result.
+LOCAL_RESCORE_FACTOR = int(os.getenv("LOCAL_RESCORE_FACTOR", "4"))
+# Rows converted to float32 at a time when scoring the quantized matrix.
+LOCAL_SCORE_BLOCK_ROWS = int(os.getenv("LOCAL_SCORE_BLOCK_ROWS", "8192"))
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class _DocumentIndex:
+    """Memory-mapped matrices and chunk metadata of one document."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.chunks: List[str] = meta["chunks"]
+        self.hashes: List[str] = meta["hashes"]
+        self.metadata: List[dict] = meta.get("metadata") or [{} for _ in self.chunks]
+        # Chunks without pages never match a page filter, as with NULLs in SQL.
+        self.page_start = np.array([m.get("page_start") if m.get("page_start") is not None else np.iinfo(np.int32).max
+                                    for m in self.metadata], dtype=np.int32)
+        self.page_end = np.array([m.get("page_end") if m.get("page_end") is not None else -1
+                                  for m in self.metadata], dtype=np.int32)
+        self.segment_type = np.array([m.get("segment_type") or "" for m in self.metadata], dtype=object)
+        self.quantized = np.load(os.path.join(path, "vectors.q.npy"), mmap_mode="r")
+        self.full = np.load(os.path.join(path, "vectors.f32.npy"), mmap_mode="r")
+        scales_path = os.path.join(path, "scales.npy")
+        self.scales = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+
+    def filter_rows(self, options: dict) -> Optional[np.ndarray]:
+        """Row numbers matching the metadata filters in ``options``, or None without filters."""
+        mask = None
+        if options.get("segment_types"):
+            mask = np.isin(self.segment_type, list(options["segment_types"]))
+        if options.get("page_from") is not None:
+            cond = self.page_end >= int(options["page_from"])
+            mask = cond if mask is None else mask & cond
+        if options.get("page_to") is not None:
+            cond = self.page_start <= int(options["page_to"])
+            mask = cond if mask is None else mask & cond
+        return None if mask is None else np.flatnonzero(mask)
+
+    def coarse_scores(self, q: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        n = len(self.chunks) if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, LOCAL_SCORE_BLOCK_ROWS):
+            if rows is None:
+                block = self.quantized[start:start + LOCAL_SCORE_BLOCK_ROWS]
+            else:
+                block = self.quantized[rows[start:start + LOCAL_SCORE_BLOCK_ROWS]]
+            scores[start:start + len(block)] = np.asarray(block, dtype=np.float32) @ q
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+        return scores
+
+    def top_k(self, q: np.ndarray, k: int, rows: Optional[np.ndarray] = None) -> List[Tuple[float, int]]:
+        """``(score, row)`` of the best ``k`` rows, searching only ``rows`` when given."""
+        n = len(self.chunks) if rows is None else len(rows)
+        if n == 0:
+            return []
+        coarse = self.coarse_scores(q, rows)
+        candidates = min(n, k * LOCAL_RESCORE_FACTOR)
+        idx = np.argpartition(-coarse, candidates - 1)[:candidates] if candidates < n else np.arange(n)
+        if rows is not None:
+            idx = rows[idx]
+        idx.sort()
+        exact = np.asarray(self.full[idx], dtype=np.float32) @ q
+        order = np.argsort(-exact)[:k]
+        return [(float(exact[i]), int(idx[i])) for i in order]
+
+
+class LocalVectorStore(VectorStore):
+    """Per-document NumPy matrices on local disk, memory-mapped for search.
+
+    Each document directory holds L2-normalized float32 vectors for re-scoring
+    and a float16 or int8 (per-row scaled) copy scanned first, so top-k costs one
+    vectorized pass over the compact matrix plus a float32 dot product over a few
+    candidates. Summary-based (hierarchical) and full-text (hybrid) retrieval need
+    Postgres and fall back to plain vector search here.
+
+    Only chunk storage and search move off the ``embeddings`` table: Postgres with
+    the pgvector extension is still required, since document summaries and the
+    embedding and answer caches are ``vector`` columns.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str = LOCAL_VECTOR_STORE_DIR, dtype: str = LOCAL_VECTOR_DTYPE):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported LOCAL_VECTOR_DTYPE: {dtype}")
+        self.root = root
+        self.dtype = dtype
+        self._open: Dict[int, Tuple[float, _DocumentIndex]] = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, document_id: int) -> str:
+        return os.path.join(self.root, str(int(document_id)))
+
+    def _index(self, document_id: int) -> Optional[_DocumentIndex]:
+        path = self._path(document_id)
+        try:
+            mtime = os.stat(os.path.join(path, "meta.json")).st_mtime_ns
+        except FileNotFoundError:
+            self._open.pop(document_id, None)
+            return None
+        cached = self._open.get(document_id)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, _DocumentIndex(path))
+            self._open[document_id] = cached
+        return cached[1]
+
+    def _document_ids(self) -> List[int]:
+        return [int(name) for name in os.listdir(self.root) if name.isdigit()]
+
+    async def existing_chunks(self, document_id: int, conn=None) -> Dict[str, List[Tuple[Any, list]]]:
+        index = self._index(document_id)
+        existing: Dict[str, List[Tuple[Any, list]]] = {}
+        if index is not None:
+            for i, hash_ in enumerate(index.hashes):
+                existing.setdefault(hash_, []).append((i, np.asarray(index.full[i]).tolist()))
+        return existing
+
+    def _write(self, document_id: int, chunks: Sequence[str], vectors: Sequence[list], hashes: Sequence[str],
+               metadata: Optional[Sequence[dict]] = None):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(chunks), -1) if len(chunks) else np.zeros((0, 0), dtype=np.float32)
+        matrix = _normalize(matrix)
+        path = self._path(document_id)
+        tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "vectors.f32.npy"), matrix)
+        if self.dtype == "int8":
+            scales = np.abs(matrix).max(axis=1, initial=0.0) / 127.0
+            scales[scales == 0] = 1.0
+            np.save(os.path.join(tmp, "vectors.q.npy"), np.round(matrix / scales[:, None]).astype(np.int8))
+            np.save(os.path.join(tmp, "scales.npy"), scales.astype(np.float32))
+        else:
+            np.save(os.path.join(tmp, "vectors.q.npy"), matrix.astype(np.float16))
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"chunks": list(chunks), "hashes": list(hashes), "dtype": self.dtype,
+                       "metadata": list(metadata) if metadata else None}, f)
+        old = f"{path}.old-{uuid.uuid4().hex}"
+        if os.path.exists(path):
+            os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+        self._open.pop(document_id, None)
+
+    async def write_chunks(self, document_id: int, chunks: Sequence[str], vectors: Sequence[list],
+                           hashes: Sequence[str], plan: ChunkPlan, conn=None,
+                           on_progress: Optional[Callable[[int], None]] = None,
+                           metadata: Optional[Sequence[dict]] = None) -> dict:
+        # Files are rewritten whole; the plan only matters for what had to be embedded.
+        start = time.perf_counter()
+        await asyncio.to_thread(self._write, document_id, chunks, vectors, hashes, metadata)
+        if on_progress:
+            on_progress(len(chunks))
+        elapsed = time.perf_counter() - start
+        return {
+            "rows": len(chunks),
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(len(chunks) / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+    def _search(self, q: np.ndarray, top_k: int, document_ids: List[int], options: dict) -> List[dict]:
+        hits = []
+        for doc_id in document_ids:
+            index = self._index(doc_id)
+            if index is None:
+                continue
+            for score, i in index.top_k(q, top_k, index.filter_rows(options)):
+                meta = index.metadata[i]
+                hits.append({"chunk": index.chunks[i], "score": score, "document_id": doc_id, "chunk_index": i,
+                             "page_start": meta.get("page_start"), "page_end": meta.get("page_end"),
+                             "segment_type": meta.get("segment_type")})
+                if options.get("with_vectors"):
+                    hits[-1]["vector"] = np.array(index.full[i], dtype=np.float32)
+        hits.sort(key=lambda h: h["score"], reverse=True)
+        return hits[:top_k]
+
+    async def search(self, query_vector: list, top_k: int, document_id: Optional[int] = None,
+                     query_text: Optional[str] = None, **options) -> List[dict]:
+        q = _normalize(np.asarray(query_vector, dtype=np.float32))
+        if document_id:
+            return self._search(q, top_k, [int(document_id)], options)
+        # Corpus-wide scans touch every document; keep them off the event loop.
+        return await asyncio.to_thread(self._search, q, top_k, self._document_ids(), options)
@@ -0,0 +1,173 @@
+import json
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.db import (
+    get_connection, to_vector_literal, set_search_params, bulk_insert_embeddings, CHUNK_METADATA_COLUMNS,
+)
+from .base import ChunkPlan, VectorStore
+
+# Columns returned for every hit, after the score; the vector is only fetched with with_vectors.
+HIT_COLUMNS = "document_id, chunk_index, page_start, page_end, segment_type"
+VECTOR_HIT_COLUMN = "vector_embedding::text"
+
+# Both candidate lists are built in one statement (one round trip) and fused
+# with weighted reciprocal rank: score = w / (k + rank), summed over lists.
+HYBRID_SQL = """
+    WITH vec AS (
+        SELECT id, row_number() OVER (ORDER BY distance) AS rank FROM (
+            SELECT id, vector_embedding <=> %(q)s::vector AS distance FROM embeddings
+            WHERE {where} ORDER BY vector_embedding <=> %(q)s::vector LIMIT %(candidates)s
+        ) v
+    ),
+    lex AS (
+        SELECT id, row_number() OVER (ORDER BY ts_rank_cd(chunk_tsv, tsq) DESC) AS rank
+        FROM embeddings, websearch_to_tsquery('english', %(text)s) tsq
+        WHERE {where} AND chunk_tsv @@ tsq
+        ORDER BY ts_rank_cd(chunk_tsv, tsq) DESC LIMIT %(candidates)s
+    ),
+    fused AS (
+        SELECT coalesce(vec.id, lex.id) AS id,
+               coalesce(%(w_vec)s / (%(rrf_k)s + vec.rank), 0) + coalesce(%(w_lex)s / (%(rrf_k)s + lex.rank), 0) AS score
+        FROM vec FULL OUTER JOIN lex ON vec.id = lex.id
+    )
+    SELECT e.chunk, f.score, {hit_columns} FROM fused f JOIN embeddings e ON e.id = f.id
+    ORDER BY f.score DESC LIMIT %(top_k)s
+"""
+
+# The outer ORDER BY restores exact order under hnsw.iterative_scan = relaxed_order.
+VECTOR_SQL = """
+    SELECT * FROM (
+        SELECT chunk, 1 - (vector_embedding <=> %(q)s::vector) AS score, {hit_columns} FROM embeddings
+        WHERE {where} ORDER BY vector_embedding <=> %(q)s::vector LIMIT %(top_k)s
+    ) hits ORDER BY score DESC
+"""
+
+# With filters, only documents that have matching chunks compete for top_docs.
+HIERARCHICAL_SQL = """
+    WITH top_docs AS (
+        SELECT id FROM documents WHERE summary_embedding IS NOT NULL{doc_filter}
+        ORDER BY summary_embedding <=> %(q)s::vector LIMIT %(top_docs)s
+    )
+    SELECT c.chunk, 1 - c.distance, {hit_columns} FROM top_docs d
+    CROSS JOIN LATERAL (
+        SELECT *, vector_embedding <=> %(q)s::vector AS distance FROM embeddings e
+        WHERE e.document_id = d.id{filters} ORDER BY e.vector_embedding <=> %(q)s::vector LIMIT %(per_doc)s
+    ) c
+    ORDER BY c.distance LIMIT %(top_k)s
+"""
+
+
+def parse_vector(text: str) -> np.ndarray:
+    """pgvector text output (``[0.1,0.2,...]``) as a float32 array, without a JSON round trip."""
+    return np.array(text[1:-1].split(","), dtype=np.float32)
+
+
+def filter_sql(options: dict, params: dict, alias: str = "") -> str:
+    """``AND ...`` conditions for the metadata filters in ``options`` (segment_types,
+    page_from, page_to); their values are added to ``params``."""
+    clauses = []
+    if options.get("segment_types"):
+        clauses.append(f"{alias}segment_type = ANY(%(segment_types)s)")
+        params["segment_types"] = list(options["segment_types"])
+    if options.get("page_from") is not None:
+        clauses.append(f"{alias}page_end >= %(page_from)s")
+        params["page_from"] = int(options["page_from"])
+    if options.get("page_to") is not None:
+        clauses.append(f"{alias}page_start <= %(page_to)s")
+        params["page_to"] = int(options["page_to"])
+    return "".join(f" AND {clause}" for clause in clauses)
+
+
+class PgVectorStore(VectorStore):
+    """Chunks in the ``embeddings`` table, searched with pgvector ANN indexes."""
+
+    name = "pgvector"
+
+    async def existing_chunks(self, document_id: int, conn=None) -> Dict[str, List[Tuple[Any, list]]]:
+        if conn is None:
+            async with get_connection() as own_conn:
+                return await self.existing_chunks(document_id, own_conn)
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT id, chunk_hash, vector_embedding::text FROM embeddings "
+                "WHERE document_id = %s AND chunk_hash IS NOT NULL ORDER BY chunk_index",
+                (document_id,),
+            )
+            existing: Dict[str, List[Tuple[Any, list]]] = {}
+            for row_id, hash_, vector in await cur.fetchall():
+                existing.setdefault(hash_, []).append((row_id, json.loads(vector)))
+        return existing
+
+    async def write_chunks(self, document_id: int, chunks: Sequence[str], vectors: Sequence[list],
+                           hashes: Sequence[str], plan: ChunkPlan, conn=None,
+                           on_progress: Optional[Callable[[int], None]] = None,
+                           metadata: Optional[Sequence[dict]] = None) -> dict:
+        if conn is None:
+            async with get_connection() as own_conn:
+                return await self.write_chunks(document_id, chunks, vectors, hashes, plan, own_conn,
+                                               on_progress, metadata)
+        retained = plan.retained
+        async with conn.cursor() as cur:
+            # Rows without a chunk_hash predate hashing and cannot be matched; replace them too.
+            await cur.execute("DELETE FROM embeddings WHERE document_id = %s AND (chunk_hash IS NULL OR id = ANY(%s))",
+                              (document_id, plan.stale_refs))
+            if retained:
+                # Unchanged text can still move (page, offsets), so provenance is refreshed too.
+                kept_meta = [metadata[idx] if metadata else {} for _, idx in retained]
+                await cur.execute(
+                    "UPDATE embeddings AS e SET chunk_index = v.idx, page_start = v.page_start, page_end = v.page_end, "
+                    "segment_type = v.segment_type, char_start = v.char_start, char_end = v.char_end "
+                    "FROM unnest(%s::int[], %s::int[], %s::int[], %s::int[], %s::text[], %s::int[], %s::int[]) "
+                    "AS v(id, idx, page_start, page_end, segment_type, char_start, char_end) WHERE e.id = v.id",
+                    ([r[0] for r in retained], [r[1] for r in retained],
+                     *([meta.get(column) for meta in kept_meta] for column in CHUNK_METADATA_COLUMNS)),
+                )
+            return await bulk_insert_embeddings(
+                cur, document_id, [chunks[i] for i in plan.new_indices], [vectors[i] for i in plan.new_indices],
+                chunk_indices=plan.new_indices,
+                metadata=[metadata[i] for i in plan.new_indices] if metadata else None,
+                on_progress=(lambda done: on_progress(len(retained) + done)) if on_progress else None,
+            )
+
+    async def search(self, query_vector: list, top_k: int, document_id: Optional[int] = None,
+                     query_text: Optional[str] = None, **options) -> List[dict]:
+        params = {"q": to_vector_literal(query_vector), "document_id": document_id, "top_k": top_k}
+        with_vectors = bool(options.get("with_vectors"))
+        columns = HIT_COLUMNS + (", " + VECTOR_HIT_COLUMN if with_vectors else "")
+        filters = filter_sql(options, params)
+        scope = "document_id = %(document_id)s" if document_id else "TRUE"
+        if options.get("retrieval_mode") == "hybrid" and query_text:
+            sql = HYBRID_SQL.format(where=scope + filters, hit_columns=", ".join(
+                f"e.{column}" for column in columns.split(", ")))
+            params.update(
+                text=query_text,
+                candidates=max(options.get("hybrid_candidates", 50), top_k),
+                w_vec=float(options.get("vector_weight", 1.0)),
+                w_lex=float(options.get("lexical_weight", 1.0)),
+                rrf_k=int(options.get("rrf_k", 60)),
+            )
+        elif not document_id and options.get("search_mode") == "hierarchical":
+            doc_filter = (
+                " AND EXISTS (SELECT 1 FROM embeddings e WHERE e.document_id = documents.id"
+                f"{filter_sql(options, params, 'e.')})" if filters else ""
+            )
+            sql = HIERARCHICAL_SQL.format(doc_filter=doc_filter, filters=filter_sql(options, params, "e."),
+                                          hit_columns=", ".join(f"c.{column}" for column in columns.split(", ")))
+            params.update(top_docs=options.get("top_docs", 5), per_doc=options.get("chunks_per_doc", 5))
+        else:
+            sql = VECTOR_SQL.format(where=scope + filters, hit_columns=columns)
+        async with get_connection() as conn:
+            async with conn.cursor() as cur:
+                await set_search_params(cur, ef_search=options.get("ef_search"), probes=options.get("probes"))
+                await cur.execute(sql, params)
+                rows = await cur.fetchall()
+        hits = []
+        for chunk, score, doc_id, chunk_index, page_start, page_end, segment_type, *vector in rows:
+            hit = {"chunk": chunk, "score": float(score), "document_id": doc_id, "chunk_index": chunk_index,
+                   "page_start": page_start, "page_end": page_end, "segment_type": segment_type}
+            if vector:
+                hit["vector"] = parse_vector(vector[0])
+            hits.append(hit)
+        return hits
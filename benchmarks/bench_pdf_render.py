@@ -0,0 +1,85 @@
+"""Compare in-process PyMuPDF clip rendering with the pdf2image page-per-call path.
+
+Usage: python -m benchmarks.bench_pdf_render path/to/file.pdf [--dpi 200] [--repeat 3]
+"""
+import argparse
+import io
+import json
+import time
+
+import fitz
+from pdf2image import convert_from_path
+
+from app.utils import render_region_png
+
+
+def page_regions(fitz_page):
+    regions = []
+    for info in fitz_page.get_images(full=True) or []:
+        for r in fitz_page.get_image_rects(info[0]) or []:
+            regions.append({'x0': r.x0, 'y0': r.y0, 'x1': r.x1, 'y1': r.y1, 'origin': 'top-left'})
+    if not regions:
+        rect = fitz_page.rect
+        regions.append({'x0': 0.0, 'y0': 0.0, 'x1': rect.width, 'y1': rect.height, 'origin': 'top-left'})
+    return regions
+
+
+def render_pdf2image(file_path, doc, dpi):
+    """The previous path: rasterize each page with pdftoppm, then crop with PIL."""
+    crops = 0
+    for page_index, fitz_page in enumerate(doc):
+        page_num = page_index + 1
+        page_img = convert_from_path(file_path, first_page=page_num, last_page=page_num, dpi=dpi)[0]
+        img_w, img_h = page_img.size
+        pg_w, pg_h = fitz_page.rect.width, fitz_page.rect.height
+        for region in page_regions(fitz_page):
+            box = (int(region['x0'] / pg_w * img_w), int(region['y0'] / pg_h * img_h),
+                   int(region['x1'] / pg_w * img_w), int(region['y1'] / pg_h * img_h))
+            if box[2] > box[0] and box[3] > box[1]:
+                buf = io.BytesIO()
+                page_img.crop(box).save(buf, format='PNG')
+                crops += 1
+    return crops
+
+
+def render_fitz(file_path, doc, dpi):
+    crops = 0
+    for fitz_page in doc:
+        pg_w, pg_h = fitz_page.rect.width, fitz_page.rect.height
+        for region in page_regions(fitz_page):
+            if render_region_png(fitz_page, region, pg_w, pg_h, dpi=dpi):
+                crops += 1
+    return crops
+
+
+def bench(fn, file_path, doc, dpi, repeat):
+    timings = []
+    crops = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        crops = fn(file_path, doc, dpi)
+        timings.append(time.perf_counter() - start)
+    return {"crops": crops, "best_seconds": round(min(timings), 4), "mean_seconds": round(sum(timings) / len(timings), 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("pdf")
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    doc = fitz.open(args.pdf)
+    results = {
+        "pdf": args.pdf,
+        "pages": doc.page_count,
+        "dpi": args.dpi,
+        "pdf2image": bench(render_pdf2image, args.pdf, doc, args.dpi, args.repeat),
+        "fitz_clip": bench(render_fitz, args.pdf, doc, args.dpi, args.repeat),
+    }
+    results["speedup"] = round(results["pdf2image"]["best_seconds"] / max(results["fitz_clip"]["best_seconds"], 1e-9), 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Time extractive summary selection across document sizes, against the previous KMeans loop.
+
+Usage: python -m benchmarks.bench_summary [--sizes 100,1000,5000,20000] [--dim 1536] [--k 5] [--repeat 3]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from sklearn.cluster import KMeans
+
+from app.util.chunk_summary import select_summary_indices
+
+
+def legacy_select(chunks, embeddings, num_summary_chunks=5):
+    """The previous implementation: default KMeans on every chunk, per-cluster Python loop."""
+    embeddings = np.array(embeddings)
+    num_summary_chunks = min(num_summary_chunks, len(chunks))
+    kmeans = KMeans(n_clusters=num_summary_chunks, random_state=42)
+    kmeans.fit(embeddings)
+    indices = []
+    for i in range(num_summary_chunks):
+        members = np.where(kmeans.labels_ == i)[0]
+        if len(members):
+            distances = np.linalg.norm(embeddings[members] - kmeans.cluster_centers_[i], axis=1)
+            indices.append(members[np.argmin(distances)])
+    return indices
+
+
+def synthetic_embeddings(n, dim, topics, rng):
+    """Unit vectors scattered around ``topics`` random directions, like chunks of a few themes."""
+    centers = rng.normal(size=(topics, dim))
+    vectors = centers[rng.integers(0, topics, n)] + 0.5 * rng.normal(size=(n, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.tolist()  # ingestion hands over lists of floats
+
+
+def bench(fn, chunks, embeddings, k, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(chunks, embeddings, k)
+        timings.append(time.perf_counter() - start)
+    return {"best_seconds": round(min(timings), 4), "mean_seconds": round(sum(timings) / len(timings), 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="100,1000,5000,20000")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy", action="store_true", help="only time the current implementation")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = []
+    for n in (int(size) for size in args.sizes.split(",")):
+        embeddings = synthetic_embeddings(n, args.dim, topics=max(args.k, 8), rng=rng)
+        chunks = [f"chunk {i}" for i in range(n)]
+        row = {"chunks": n, "dim": args.dim, "current": bench(select_summary_indices, chunks, embeddings, args.k, args.repeat)}
+        if not args.skip_legacy:
+            row["legacy"] = bench(legacy_select, chunks, embeddings, args.k, args.repeat)
+            row["speedup"] = round(row["legacy"]["best_seconds"] / max(row["current"]["best_seconds"], 1e-9), 2)
+        results.append(row)
+        print(json.dumps(row))
+    print(json.dumps({"results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Check the chunker's invariants: token bound, overlap, coverage and linear work.
+
+Usage: python -m benchmarks.check_chunker [--max-tokens 120] [--overlap 30] [--sentences 2000]
+
+Exits non-zero with an AssertionError naming the first broken invariant.
+Uses tiktoken when installed, else the character heuristic in app.util.tokens.
+"""
+import argparse
+import random
+
+from app.util import chunker
+from app.util.chunker import iter_chunk_records, iter_sentence_spans, iter_segment_records, iter_text_records
+from app.util.tokens import count_tokens
+
+WORDS = ("fund member contribution withdrawal fee balance transfer rule annual report table "
+         "eligibility account statement benefit insurance retirement option").split()
+
+
+def synthetic_paragraphs(sentences: int, rng: random.Random):
+    """Paragraphs of random sentences, with an occasional sentence far longer than a chunk."""
+    paragraphs, current = [], []
+    for i in range(sentences):
+        length = rng.randint(200, 400) if i % 97 == 0 else rng.randint(4, 30)
+        current.append(" ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + ".")
+        if rng.random() < 0.15:
+            paragraphs.append(" ".join(current))
+            current = []
+    if current:
+        paragraphs.append(" ".join(current))
+    return paragraphs
+
+
+def check_bounds_and_overlap(paragraphs, max_tokens: int, overlap: int):
+    source = "\n".join(paragraphs)
+    records = list(iter_text_records(paragraphs, max_tokens, overlap))
+    assert records, "no chunks produced"
+    for text, meta in records:
+        # Joining units with a separator may add about one token per join.
+        assert count_tokens(text) <= max_tokens + text.count(" ") // 8 + 1, \
+            f"chunk of {count_tokens(text)} tokens exceeds max_tokens={max_tokens}"
+        assert meta["char_start"] < meta["char_end"] <= len(source), f"bad offsets {meta}"
+    for (_, prev), (_, nxt) in zip(records, records[1:]):
+        assert nxt["char_start"] >= prev["char_start"], "chunks out of document order"
+        if nxt["char_start"] < prev["char_end"]:
+            carried = source[nxt["char_start"]:prev["char_end"]]
+            assert count_tokens(carried) <= overlap + carried.count(" ") // 8 + 1, \
+                f"overlap of {count_tokens(carried)} tokens exceeds overlap_tokens={overlap}"
+    # Every sentence lands in some chunk.
+    spans = [(meta["char_start"], meta["char_end"]) for _, meta in records]
+    offset, j = 0, 0
+    for paragraph in paragraphs:
+        for _, start, end in iter_sentence_spans(paragraph):
+            start, end = offset + start, offset + end
+            while j < len(spans) and spans[j][1] < end:
+                j += 1
+            assert j < len(spans) and spans[j][0] <= end, f"sentence at {start}-{end} not in any chunk"
+        offset += len(paragraph) + 1
+    return len(records)
+
+
+def check_group_boundaries(max_tokens: int, overlap: int):
+    segments = [{"type": "text", "page": 1, "content": "Intro sentence about the fund. " * 5},
+                {"type": "table_row", "page": 1, "content": "Fee:1% | Year:2024"},
+                {"type": "table_row", "page": 2, "content": "Fee:2% | Year:2025"},
+                {"type": "text", "page": 2, "content": "Closing remarks on withdrawals."}]
+    records = list(iter_segment_records(segments, max_tokens, overlap))
+    for (_, prev), (_, nxt) in zip(records, records[1:]):
+        if prev["segment_type"] != nxt["segment_type"]:
+            assert nxt["char_start"] >= prev["char_end"], "overlap carried across segment types"
+    assert [meta["segment_type"] for _, meta in records] == ["text", "table_row", "text"], \
+        f"unexpected grouping {[meta['segment_type'] for _, meta in records]}"
+    assert records[1][1]["page_start"] == 1 and records[1][1]["page_end"] == 2, "page range lost"
+
+
+def tokenized_chars(paragraphs, max_tokens: int, overlap: int) -> int:
+    """Characters passed to count_tokens while chunking; linear work means proportional to the input."""
+    total = 0
+    original = chunker.count_tokens
+
+    def counting(text):
+        nonlocal total
+        total += len(text)
+        return original(text)
+
+    chunker.count_tokens = counting
+    try:
+        list(iter_chunk_records(
+            ((s, "text", None, 0, 0) for p in paragraphs for s, _, _ in iter_sentence_spans(p)),
+            max_tokens, overlap))
+    finally:
+        chunker.count_tokens = original
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-tokens", type=int, default=120)
+    parser.add_argument("--overlap", type=int, default=30)
+    parser.add_argument("--sentences", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    small = synthetic_paragraphs(args.sentences, rng)
+    chunks = check_bounds_and_overlap(small, args.max_tokens, args.overlap)
+    check_group_boundaries(args.max_tokens, args.overlap)
+
+    large = small * 4
+    input_small, input_large = sum(map(len, small)), sum(map(len, large))
+    work_small = tokenized_chars(small, args.max_tokens, args.overlap)
+    work_large = tokenized_chars(large, args.max_tokens, args.overlap)
+    # Each unit is tokenized once (long ones once more as windows), never re-tokenized per chunk.
+    assert work_small <= 2 * input_small and work_large <= 2 * input_large, \
+        f"tokenized {work_large} chars for {input_large} input chars"
+    print(f"ok: {chunks} chunks, tokenized {work_small / input_small:.2f}x / {work_large / input_large:.2f}x "
+          "the input at 1x / 4x size")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Check that parallel PDF extraction returns exactly the serial path's segments.
+
+Usage: python -m benchmarks.check_parallel_extract [pdf] [--workers 4] [--pages 40]
+
+Without a pdf, a synthetic one (paragraphs, a table-like layout and an embedded
+image on every page) is generated with PyMuPDF. Exits non-zero with an
+AssertionError at the first differing segment.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+
+import fitz
+
+from app.utils import PDF_PAGES_PER_TASK, extract_pdf_pages_parallel, shutdown_process_pool
+
+
+def synthetic_pdf(path: str, pages: int):
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+    doc = fitz.open()
+    for n in range(1, pages + 1):
+        pix.set_rect(pix.irect, (n * 37 % 256, 90, 160))
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {n}. The fund objectives and fees for members.\n\n"
+                                   f"Withdrawals on page {n} need a signed request.", fontsize=11)
+        for row, (name, value) in enumerate([("Fee", f"{n}%"), ("Year", str(2000 + n))]):
+            page.insert_text((72, 160 + 16 * row), name, fontsize=10)
+            page.insert_text((200, 160 + 16 * row), value, fontsize=10)
+        page.insert_image(fitz.Rect(72, 240, 232, 400), stream=pix.tobytes("png"))
+    doc.save(path)
+    doc.close()
+
+
+async def compare(path: str, workers: int):
+    pages_seen = []
+    serial = await extract_pdf_pages_parallel(path, workers=1, on_progress=lambda done, total: pages_seen.append(done))
+    parallel = await extract_pdf_pages_parallel(path, workers=workers)
+    assert len(serial) == len(parallel), f"{len(serial)} serial segments vs {len(parallel)} parallel"
+    for i, (a, b) in enumerate(zip(serial, parallel)):
+        assert a == b, f"segment {i} differs:\n  serial:   {a.get('type')} p.{a.get('page')}\n  parallel: {b.get('type')} p.{b.get('page')}"
+    with fitz.open(path) as doc:
+        assert pages_seen == list(range(1, doc.page_count + 1)), "serial path did not report progress per page"
+    return len(serial)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", nargs="?")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=5 * PDF_PAGES_PER_TASK,
+                        help="pages of the synthetic pdf (several ranges, so the process pool is used)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.pdf
+        if path is None:
+            path = os.path.join(tmp, "synthetic.pdf")
+            synthetic_pdf(path, args.pages)
+        try:
+            segments = asyncio.run(compare(path, args.workers))
+        finally:
+            shutdown_process_pool()
+    print(f"ok: {segments} segments identical with workers=1 and workers={args.workers}")
+
+
+if __name__ == "__main__":
+    main()
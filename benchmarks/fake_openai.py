@@ -0,0 +1,157 @@
+"""Local OpenAI-compatible stand-in for offline benchmarks (embeddings, chat, vision).
+
+Usage: python -m benchmarks.fake_openai [--port 9100] [--latency-ms 150] [--token-ms 15] [--rate-429 0.02]
+
+Point the app at it with OPENAI_API_BASE and EMBEDDING_OPENAI_API_BASE set to
+http://127.0.0.1:<port>/v1. Embeddings are hashed bags of words, so texts that
+share words are close and retrieval behaves sensibly; chat answers are filler
+text streamed token by token. GET /stats reports request and 429 counts.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import time
+import uuid
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1536"))
+
+FILLER = ("The document describes the fund objectives, fees, eligibility rules and the steps members "
+          "must follow before making a withdrawal or transfer request.").split()
+
+config = {"latency_ms": 150.0, "jitter_ms": 50.0, "token_ms": 15.0, "embed_ms_per_input": 0.5,
+          "rate_429": 0.0, "completion_tokens": 120}
+counters = Counter()
+
+app = FastAPI()
+
+
+def embed(text: str) -> list:
+    vector = [0.0] * EMBEDDING_DIM
+    for word in text.lower().split():
+        digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % EMBEDDING_DIM
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+async def simulate_latency(extra_ms: float = 0.0):
+    delay = config["latency_ms"] + random.uniform(0, config["jitter_ms"]) + extra_ms
+    await asyncio.sleep(delay / 1000)
+
+
+def rate_limited(kind: str):
+    counters[f"{kind}_requests"] += 1
+    if random.random() < config["rate_429"]:
+        counters[f"{kind}_429"] += 1
+        return JSONResponse(status_code=429, headers={"Retry-After": "0"},
+                            content={"error": {"message": "Rate limit reached (simulated)", "type": "rate_limit_error"}})
+    return None
+
+
+def reply_for(messages: list) -> str:
+    system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system" and isinstance(m.get("content"), str))
+    user = messages[-1].get("content") if messages else ""
+    if "routing assistant" in system:
+        return '["doc_search", "llm_synthesis"]'
+    if isinstance(user, list):  # vision request
+        counters["vision_requests"] += 1
+        return "A bar chart comparing annual fund returns across five years."
+    words = [FILLER[i % len(FILLER)] for i in range(config["completion_tokens"])]
+    return " ".join(words) + "."
+
+
+def usage(prompt: str, completion: str) -> dict:
+    prompt_tokens, completion_tokens = len(prompt) // 4 + 1, len(completion.split())
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    if (limited := rate_limited("embeddings")) is not None:
+        return limited
+    body = await request.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    counters["embedded_inputs"] += len(inputs)
+    await simulate_latency(config["embed_ms_per_input"] * len(inputs))
+    tokens = sum(len(text) // 4 + 1 for text in inputs)
+    return {
+        "object": "list",
+        "model": body.get("model", "fake-embedding"),
+        "data": [{"object": "embedding", "index": i, "embedding": embed(text)} for i, text in enumerate(inputs)],
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    if (limited := rate_limited("chat")) is not None:
+        return limited
+    body = await request.json()
+    messages = body.get("messages", [])
+    content = reply_for(messages)
+    prompt = json.dumps(messages)
+    completion_id, created, model = f"chatcmpl-{uuid.uuid4().hex}", int(time.time()), body.get("model", "fake-chat")
+    await simulate_latency()
+
+    if not body.get("stream"):
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage(prompt, content),
+        }
+
+    async def stream():
+        def frame(delta: dict, finish_reason=None) -> str:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            return f"data: {json.dumps(chunk)}\n\n"
+
+        yield frame({"role": "assistant", "content": ""})
+        for i, word in enumerate(content.split(" ")):
+            await asyncio.sleep(config["token_ms"] / 1000)
+            yield frame({"content": word if i == 0 else " " + word})
+        yield frame({}, finish_reason="stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def stats():
+    return dict(counters)
+
+
+@app.get("/")
+async def root():
+    return {"status": "ok", "config": config}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=config["latency_ms"], help="base latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=config["jitter_ms"], help="uniform extra latency")
+    parser.add_argument("--token-ms", type=float, default=config["token_ms"], help="delay between streamed tokens")
+    parser.add_argument("--embed-ms-per-input", type=float, default=config["embed_ms_per_input"])
+    parser.add_argument("--rate-429", type=float, default=config["rate_429"], help="fraction of requests answered with 429")
+    parser.add_argument("--completion-tokens", type=int, default=config["completion_tokens"])
+    args = parser.parse_args()
+    for key in config:
+        config[key] = getattr(args, key)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()